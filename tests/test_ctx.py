@@ -5,9 +5,12 @@ from ryz.res import Ok, Res
 from ryz.uuid import uuid4
 
 from tests.conftest import (
+    EmptyMock,
     Mock_1,
+    Mock_2,
     MockCon,
     get_mock_ctx_manager_for_msg,
+    get_mock_ctx_manager_for_srpc_send,
     yon_mock_ctx,
 )
 from yon.server import (
@@ -15,8 +18,10 @@ from yon.server import (
     BusCfg,
     ConArgs,
     EmptyRpcArgs,
+    PubOpts,
     RpcRecv,
     RpcSend,
+    SubOpts,
     Transport,
     ok,
 )
@@ -86,7 +91,7 @@ async def test_rpc_custom_ctx_manager():
                 is_server=True,
                 con_type=MockCon)
         ],
-        sub_ctxfn=get_mock_ctx_manager_for_msg))
+        rpc_ctxfn=get_mock_ctx_manager_for_srpc_send))
 
     con = MockCon(ConArgs(core=None))
     async def rpc_update_email(msg: EmptyRpcArgs) -> Res[int]:
@@ -109,5 +114,49 @@ async def test_rpc_custom_ctx_manager():
     rbmsg = await asyncio.wait_for(con.client__recv(), 1)
     assert rbmsg["codeid"] == \
         (await Code.get_regd_codeid_by_type(RpcRecv)).eject()
+    # rpcfn's asserts have passed inside the ctx manager
+    assert rbmsg["msg"] == 0
 
     con_task.cancel()
+
+async def test_subfn_lsid(sbus: Bus):
+    linked = []
+
+    async def ofilter__unlink(retval):
+        sbus.set_ctx_subfn_lsid(None)
+        return retval
+
+    async def sub_mock_1(msg: Mock_1):
+        assert sbus.get_ctx()["msid"]
+        return Mock_2(num=2)
+
+    async def sub_mock_2(msg: Mock_2):
+        linked.append(msg)
+
+    await sbus.sub(Mock_1, sub_mock_1, SubOpts(out_filters=[ofilter__unlink]))
+    await sbus.sub(Mock_2, sub_mock_2)
+
+    # the response is published, but not linked to the request
+    r = await sbus.pubr(Mock_1(num=1), PubOpts(pubr_timeout=0.1))
+    assert isinstance(r.errval, TimeoutError)
+    assert len(linked) == 1
+
+async def test_subfn_lsid_is_scoped(sbus: Bus):
+    async def ofilter__unlink(retval):
+        sbus.set_ctx_subfn_lsid(None)
+        return retval
+
+    async def sub_mock_1(msg: Mock_1):
+        return Mock_2(num=2)
+
+    async def sub_empty_mock(msg: EmptyMock):
+        return
+
+    await sbus.sub(Mock_1, sub_mock_1, SubOpts(out_filters=[ofilter__unlink]))
+    await sbus.sub(EmptyMock, sub_empty_mock)
+
+    (await sbus.pub(Mock_1(num=1))).eject()
+    # the unlinking is done only for the filtered subfn call
+    assert "subfn_lsid" not in sbus.get_ctx()
+    r = await sbus.pubr(EmptyMock(), PubOpts(pubr_timeout=0.1))
+    assert isinstance(r.okval, ok)
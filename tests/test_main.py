@@ -1,11 +1,15 @@
 import asyncio
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Any
 
+import pytest
 from pydantic import BaseModel
 from ryz.code import Code
 from ryz.err import ValErr
 from ryz.err_utils import get_err_msg
-from ryz.res import Err, Ok, valerr
+from ryz.res import Err, Ok, Res, valerr
 from ryz.uuid import uuid4
 
 from tests.conftest import (
@@ -15,6 +19,7 @@ from tests.conftest import (
     MockCon,
 )
 from yon.server import (
+    Bmsg,
     Bus,
     BusCfg,
     ConArgs,
@@ -24,6 +29,9 @@ from yon.server import (
     PubOpts,
     StaticCodeid,
     Transport,
+    cpu_bound,
+    install_uvloop,
+    rpc,
     sub,
 )
 
@@ -42,6 +50,71 @@ async def test_pubsub(sbus: Bus):
 
     assert flag
 
+async def test_pubsub_concurrent(sbus: Bus):
+    evt = asyncio.Event()
+    calls = []
+
+    async def sub_waiter(msg: Mock_1):
+        # would block forever if subfns were called one by one
+        await asyncio.wait_for(evt.wait(), 1)
+        calls.append("waiter")
+
+    async def sub_setter(msg: Mock_1):
+        evt.set()
+        calls.append("setter")
+
+    async def sub_failer(msg: Mock_1):
+        raise ValueError
+
+    (await sbus.sub(Mock_1, sub_waiter)).eject()
+    (await sbus.sub(Mock_1, sub_failer)).eject()
+    (await sbus.sub(Mock_1, sub_setter)).eject()
+    (await sbus.pub(Mock_1(num=1))).eject()
+
+    assert calls == ["setter", "waiter"]
+
+    async def sub_mock_2_failer(msg: Mock_2):
+        raise ValueError
+
+    # single failing subfn is handled the same way
+    (await sbus.sub(Mock_2, sub_mock_2_failer)).eject()
+    (await sbus.pub(Mock_2(num=1))).eject()
+
+async def test_unsub(sbus: Bus):
+    calls = []
+
+    async def sub_1(msg: Mock_1):
+        calls.append(1)
+
+    async def sub_2(msg: Mock_1):
+        calls.append(2)
+
+    unsub_1 = (await sbus.sub(Mock_1, sub_1)).eject()
+    unsub_2 = (await sbus.sub(Mock_1, sub_2)).eject()
+    (await unsub_1()).eject()
+    (await sbus.pub(Mock_1(num=1))).eject()
+    assert calls == [2]
+
+    (await unsub_2()).eject()
+    (await sbus.pub(Mock_1(num=1))).eject()
+    assert calls == [2]
+    assert isinstance(await unsub_2(), Err)
+
+async def test_pubsub_sync_subfn(sbus: Bus):
+    responses = []
+
+    def sub_mock_1(msg: Mock_1) -> Mock_2:
+        return Mock_2(num=msg.num + 1)
+
+    async def sub_mock_2(msg: Mock_2):
+        responses.append(msg.num)
+
+    (await sbus.sub(Mock_1, sub_mock_1)).eject()  # type: ignore
+    (await sbus.sub(Mock_2, sub_mock_2)).eject()
+    (await sbus.pub(Mock_1(num=1))).eject()
+
+    assert responses == [2]
+
 async def test_data_static_indexes(sbus: Bus):
     codes = (await Code.get_regd_codes()).eject()
     assert codes[0] == "yon::server::welcome"
@@ -315,3 +388,152 @@ async def test_sub_decorator():
     sbus = Bus.ie()
     await sbus.init(BusCfg(reg_types={Mock}))
     assert Mock.code() in sbus._code_to_subfns
+
+async def test_sub_decorator_order():
+    calls = []
+
+    @sub(Mock_1)
+    async def sub_1(msg: Mock_1):
+        calls.append(1)
+
+    @sub(Mock_1)
+    async def sub_2(msg: Mock_1):
+        calls.append(2)
+
+    sbus = Bus.ie()
+    await sbus.init(BusCfg(reg_types={Mock_1}))
+    assert len(sbus._code_to_subfns[Mock_1.code()]) == 2
+    (await sbus.pub(Mock_1(num=1))).eject()
+    assert calls == [1, 2]
+
+async def test_cpu_bound():
+    loop_thread = threading.get_ident()
+    sub_thread = None
+
+    @cpu_bound
+    def sub_mock_1(msg: Mock_1):
+        nonlocal sub_thread
+        sub_thread = threading.get_ident()
+        return Mock_2(num=msg.num)
+
+    executor = ThreadPoolExecutor(1)
+    sbus = Bus.ie()
+    await sbus.init(BusCfg(
+        reg_types=[Mock_1, Mock_2],
+        cpu_executor=executor))
+    (await sbus.sub(Mock_1, sub_mock_1)).eject()
+
+    response = (await sbus.pubr(
+        Mock_1(num=1), PubOpts(pubr_timeout=1))).eject()
+    assert response == Mock_2(num=1)
+    assert sub_thread is not None
+    assert sub_thread != loop_thread
+    executor.shutdown()
+
+@cpu_bound
+def square_mock_1(msg: Mock_1) -> Mock_2:
+    return Mock_2(num=msg.num * msg.num)
+
+async def test_cpu_bound_process_pool():
+    # decorators return the fn itself, so it's pickled by module attribute
+    assert sub(Mock_1)(square_mock_1) is square_mock_1
+
+    executor = ProcessPoolExecutor(1)
+    sbus = Bus.ie()
+    await sbus.init(BusCfg(
+        reg_types=[Mock_1, Mock_2],
+        cpu_executor=executor))
+
+    response = (await sbus.pubr(
+        Mock_1(num=3), PubOpts(pubr_timeout=5))).eject()
+    assert response == Mock_2(num=9)
+    executor.shutdown()
+
+def test_cpu_bound_async():
+    async def sub_mock_1(msg: Mock_1):
+        return
+
+    with pytest.raises(TypeError):
+        cpu_bound(sub_mock_1)
+
+async def test_cpu_bound_above_rpc():
+    loop_thread = threading.get_ident()
+
+    @cpu_bound
+    @rpc("get_thread")
+    def rpc_get_thread(msg: Mock_1) -> Res[int]:
+        return Ok(threading.get_ident())
+
+    executor = ThreadPoolExecutor(1)
+    sbus = Bus.ie()
+    await sbus.init(BusCfg(cpu_executor=executor))
+    run = sbus._rpckey_to_fn["get_thread"][3]
+    assert run is not rpc_get_thread
+    assert (await run(Mock_1(num=1))).okval != loop_thread
+    executor.shutdown()
+
+async def test_transport_workers():
+    nums: list[int] = []
+
+    async def sub_mock_1(msg: Mock_1):
+        await asyncio.sleep(0)
+        nums.append(msg.num)
+
+    sbus = Bus.ie()
+    await sbus.init(BusCfg(
+        transports=[
+            Transport(
+                is_server=True,
+                con_type=MockCon,
+                inp_workers=3,
+                out_workers=2)
+        ],
+        reg_types=[Mock_1]))
+    atransport = sbus._con_type_to_atransport[MockCon]
+    assert len(atransport.inp_queue_processors) == 3
+    assert len(atransport.out_queue_processors) == 2
+    (await sbus.sub(Mock_1, sub_mock_1)).eject()
+
+    con = MockCon(ConArgs(core=None))
+    con_task = asyncio.create_task(sbus.con(con))
+    # welcome
+    await asyncio.wait_for(con.client__recv(), 1)
+    mock_1_codeid = (await Code.get_regd_codeid_by_type(Mock_1)).eject()
+    for i in range(10):
+        await con.client__send({
+            "sid": uuid4(),
+            "codeid": mock_1_codeid,
+            "msg": {"num": i}
+        })
+    for _ in range(100):
+        if len(nums) == 10:
+            break
+        await asyncio.sleep(0.01)
+    assert sorted(nums) == list(range(10))
+    con_task.cancel()
+
+async def test_deserialize_from_net(sbus: Bus):
+    mock_1_codeid = (await Code.get_regd_codeid_by_type(Mock_1)).eject()
+    rbmsg = {"sid": "1", "codeid": mock_1_codeid, "msg": {"num": 1}}
+    bmsg = (await Bmsg.deserialize_from_net(rbmsg, "con_1")).eject()
+    assert bmsg.msg == Mock_1(num=1)
+    assert bmsg.skip__consid == "con_1"
+    assert bmsg.skip__code == Mock_1.code()
+    # received dict is left untouched
+    assert rbmsg == {"sid": "1", "codeid": mock_1_codeid, "msg": {"num": 1}}
+
+def test_install_uvloop_unavailable(monkeypatch):
+    policy = asyncio.get_event_loop_policy()
+    # makes "import uvloop" raise ImportError
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+    assert not install_uvloop()
+    assert asyncio.get_event_loop_policy() is policy
+
+async def test_con_unregd_transport(sbus: Bus):
+    class UnregdCon(MockCon):
+        pass
+
+    con = UnregdCon(ConArgs(core=None))
+    await asyncio.wait_for(sbus.con(con), 1)
+    assert con.is_closed()
+    assert con.sid not in sbus._sid_to_con
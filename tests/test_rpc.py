@@ -12,7 +12,15 @@ from tests.conftest import (
     MockCon,
     find_codeid_in_welcome_rbmsg,
 )
-from yon.server import Bus, ConArgs, rpc
+from yon.server import (
+    Bus,
+    BusCfg,
+    ConArgs,
+    RpcRecv,
+    RpcSend,
+    Transport,
+    rpc,
+)
 
 
 async def test_main(sbus: Bus):
@@ -50,6 +58,8 @@ async def test_main(sbus: Bus):
     rpc_rbmsg = await asyncio.wait_for(con_1.client__recv(), 1)
     rpc_msg = rpc_rbmsg["msg"]
     assert rpc_msg == 0
+    assert rpc_rbmsg["codeid"] == find_codeid_in_welcome_rbmsg(
+        RpcRecv.code(), welcome_rbmsg).eject()
 
     rpckey = "update_email"
     send_msid = uuid4()
@@ -70,6 +80,71 @@ async def test_main(sbus: Bus):
 
     con_task_1.cancel()
 
+async def test_recv_concurrency():
+    sbus = Bus.ie()
+    await sbus.init(BusCfg(transports=[
+        Transport(
+            is_server=True,
+            con_type=MockCon,
+            max_recv_concurrency=1)
+    ]))
+    release = asyncio.Event()
+    calls = []
+
+    async def rpc_wait(msg: EmptyMock) -> Res[int]:
+        calls.append(1)
+        await release.wait()
+        return Ok(len(calls))
+    Bus.reg_rpc("wait", rpc_wait).eject()
+
+    con = MockCon(ConArgs(core=None))
+    con_task = asyncio.create_task(sbus.con(con))
+    welcome_rbmsg = await asyncio.wait_for(con.client__recv(), 1)
+    yon_rpc_req_codeid = find_codeid_in_welcome_rbmsg(
+        "yon::server::rpc_send", welcome_rbmsg).eject()
+
+    for _ in range(2):
+        await con.client__send({
+            "sid": uuid4(),
+            "codeid": yon_rpc_req_codeid,
+            "msg": {"key": "wait", "data": {}}
+        })
+    await asyncio.sleep(0.05)
+    # second call waits until the first one frees the slot
+    assert len(calls) == 1
+
+    release.set()
+    assert (await asyncio.wait_for(con.client__recv(), 1))["msg"] == 1
+    assert (await asyncio.wait_for(con.client__recv(), 1))["msg"] == 2
+
+    con_task.cancel()
+
+async def test_destroy_cancels_rpc(sbus: Bus):
+    started = asyncio.Event()
+
+    async def rpc_wait(msg: EmptyMock) -> Res[int]:
+        started.set()
+        await asyncio.Event().wait()
+        return Ok(0)
+    Bus.reg_rpc("wait", rpc_wait).eject()
+
+    con = MockCon(ConArgs(core=None))
+    con_task = asyncio.create_task(sbus.con(con))
+    welcome_rbmsg = await asyncio.wait_for(con.client__recv(), 1)
+    yon_rpc_req_codeid = find_codeid_in_welcome_rbmsg(
+        "yon::server::rpc_send", welcome_rbmsg).eject()
+    await con.client__send({
+        "sid": uuid4(),
+        "codeid": yon_rpc_req_codeid,
+        "msg": {"key": "wait", "data": {}}
+    })
+    await asyncio.wait_for(started.wait(), 1)
+    (rpc_task,) = sbus._rpc_tasks
+
+    con_task.cancel()
+    await Bus.destroy()
+    assert rpc_task.cancelled()
+
 async def test_srpc_decorator():
     @rpc("test")
     async def rpc_test(msg: EmptyMock) -> Res[Any]:
@@ -86,6 +161,37 @@ async def test_reg_custom_rpc_key():
     bus.reg_rpc("whocares", rpc_test).eject()
     assert "whocares" in bus._rpckey_to_fn
 
+async def test_infer_msgtype():
+    async def rpc_test(msg: EmptyMock) -> Res[None]:
+        return Ok()
+
+    async def rpc_no_msg(body: EmptyMock) -> Res[None]:
+        return Ok()
+
+    bus = Bus.ie()
+    await bus.init()
+    bus.reg_rpc("test", rpc_test).eject()
+    bus.reg_rpc("test_2", rpc_test).eject()
+    assert bus._rpckey_to_fn["test"][:2] == (rpc_test, EmptyMock)
+    assert bus._rpckey_to_fn["test_2"][:2] == (rpc_test, EmptyMock)
+
+    r = bus.reg_rpc("no_msg", rpc_no_msg)
+    assert isinstance(r, Err)
+    assert "no_msg" not in bus._rpckey_to_fn
+
+async def test_infer_msgtype_not_weakrefable():
+    class SlottedRpc:
+        __slots__ = ()
+
+        async def __call__(self, msg: EmptyMock) -> Res[None]:
+            return Ok()
+
+    rpc_test = SlottedRpc()
+    bus = Bus.ie()
+    await bus.init()
+    bus.reg_rpc("test", rpc_test).eject()
+    assert bus._rpckey_to_fn["test"][:2] == (rpc_test, EmptyMock)
+
 async def test_provide_custom_msgtype():
     class Something(BaseModel):
         pass
@@ -96,7 +202,8 @@ async def test_provide_custom_msgtype():
     bus = Bus.ie()
     await bus.init()
     bus.reg_rpc("test", rpc_test, Something).eject()
-    assert bus._rpckey_to_fn["test"] == (rpc_test, Something)
+    assert bus._rpckey_to_fn["test"] == (
+        rpc_test, Something, Something.model_validate, rpc_test)
 
 async def test_provide_custom_msgtype_wrong():
     class Something(BaseModel):
@@ -110,3 +217,9 @@ async def test_provide_custom_msgtype_wrong():
     r = bus.reg_rpc("test", rpc_test, int)  # type: ignore
     assert isinstance(r, Err)
     assert "test" not in bus._rpckey_to_fn
+
+async def test_pub_rpc_msg(sbus: Bus):
+    r = await sbus.pub(RpcSend(key="test", data={}))
+    assert isinstance(r, Err)
+    r = await sbus.sub(RpcRecv, lambda _: None)  # type: ignore
+    assert isinstance(r, Err)
@@ -0,0 +1,101 @@
+import asyncio
+import struct
+
+import pytest
+from ryz.code import Code
+from ryz.uuid import uuid4
+
+from tests.conftest import Mock_1, Mock_2
+from yon.server import Bus, BusCfg, Tcp, TcpProtocol, Transport
+from yon.server._tcp import (
+    LARGE_PAYLOAD_SIZE,
+    MAX_FRAME_SIZE,
+    pack_frame_into,
+    unpack_frames,
+)
+from yon.server._transport import json_dumps, json_loads
+
+_HEADER = struct.Struct("!I")
+
+async def _recv(reader: asyncio.StreamReader) -> dict:
+    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return json_loads(await reader.readexactly(size))
+
+def _pack(payload: bytes) -> bytes:
+    return _HEADER.pack(len(payload)) + payload
+
+def _frame(data: dict) -> bytes:
+    return _pack(json_dumps(data).encode())
+
+async def test_tcp():
+    sbus = Bus.ie()
+    await sbus.init(BusCfg(
+        transports=[Transport(is_server=True, con_type=Tcp)],
+        reg_types=[Mock_1, Mock_2]))
+
+    async def sub_mock_1(msg: Mock_1):
+        return Mock_2(num=msg.num + 1)
+    (await sbus.sub(Mock_1, sub_mock_1)).eject()
+
+    server = await asyncio.get_running_loop().create_server(
+        lambda: TcpProtocol(sbus.con), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    welcome = await asyncio.wait_for(_recv(reader), 1)
+    assert welcome["msg"]["codes"][0] == "yon::server::welcome"
+
+    mock_1_codeid = (await Code.get_regd_codeid_by_type(Mock_1)).eject()
+    sid = uuid4()
+    # send two frames in one write, with the second one split
+    data = \
+        _frame({"sid": sid, "codeid": mock_1_codeid, "msg": {"num": 1}}) \
+        + _frame({"sid": uuid4(), "codeid": mock_1_codeid, "msg": {"num": 5}})
+    writer.write(data[:-3])
+    await writer.drain()
+    await asyncio.sleep(0.01)
+    writer.write(data[-3:])
+    await writer.drain()
+
+    response = await asyncio.wait_for(_recv(reader), 1)
+    assert response["lsid"] == sid
+    assert response["msg"]["num"] == 2
+    response = await asyncio.wait_for(_recv(reader), 1)
+    assert response["msg"]["num"] == 6
+
+    # big msgs are written in a separate way
+    con = next(iter(sbus._sid_to_con.values()))
+    big = {"data": "x" * LARGE_PAYLOAD_SIZE}
+    await con.send(big)
+    assert await asyncio.wait_for(_recv(reader), 1) == big
+
+    writer.close()
+    await writer.wait_closed()
+    # let the bus finish the closed con
+    await asyncio.sleep(0.01)
+    server.close()
+    await server.wait_closed()
+
+def test_frames():
+    buf = bytearray(_pack(b"hello") + _pack(b"") + _pack(b"world"))
+    payloads, consumed = unpack_frames(buf[:-2])
+    assert payloads == [b"hello", b""]
+    assert consumed == len(_pack(b"hello")) + len(_pack(b""))
+
+    payloads, consumed = unpack_frames(buf)
+    assert payloads == [b"hello", b"", b"world"]
+    assert consumed == len(buf)
+
+def test_frame_into():
+    buf = bytearray(b"x" * 16)
+    size = pack_frame_into(buf, b"hello")
+    assert size == _HEADER.size + 5
+    assert buf[:size] == _pack(b"hello")
+
+    payloads, consumed = unpack_frames(buf[:size])
+    assert payloads == [b"hello"]
+    assert consumed == size
+
+def test_frames_too_big():
+    with pytest.raises(ValueError):
+        unpack_frames(bytearray(_HEADER.pack(MAX_FRAME_SIZE + 1)))
@@ -0,0 +1,103 @@
+import asyncio
+from asyncio import QueueFull
+
+import pytest
+
+from yon.server import Tcp, Transport
+from yon.server._transport import BatchQueue, PreparedRbmsg
+
+
+async def test_batch_queue_put():
+    queue: BatchQueue[int] = BatchQueue()
+    queue.put_nowait(1)
+    await queue.put(2)
+
+    assert len(queue) == 2
+    assert list(await queue.get_batch(1)) == [1]
+    assert list(await queue.get_batch(1)) == [2]
+    assert len(queue) == 0
+
+async def test_batch_queue_get_batch():
+    queue: BatchQueue[int] = BatchQueue()
+    for i in range(5):
+        queue.put_nowait(i)
+
+    assert list(await queue.get_batch(3)) == [0, 1, 2]
+    batch = await queue.get_batch()
+    assert list(batch) == [3, 4]
+
+    # taken batch is not affected by further puts
+    queue.put_nowait(5)
+    assert list(batch) == [3, 4]
+    assert len(queue) == 1
+
+async def test_batch_queue_get_waits():
+    queue: BatchQueue[int] = BatchQueue()
+    task = asyncio.create_task(queue.get_batch())
+    await asyncio.sleep(0)
+    assert not task.done()
+
+    queue.put_nowait(1)
+    queue.put_nowait(2)
+    assert list(await asyncio.wait_for(task, 1)) == [1, 2]
+
+async def test_batch_queue_maxsize():
+    queue: BatchQueue[int] = BatchQueue(2)
+    queue.put_nowait(1)
+    queue.put_nowait(2)
+    assert queue.is_full()
+    with pytest.raises(QueueFull):
+        queue.put_nowait(3)
+
+    put_task = asyncio.create_task(queue.put(3))
+    await asyncio.sleep(0)
+    assert not put_task.done()
+
+    assert list(await queue.get_batch(1)) == [1]
+    await asyncio.wait_for(put_task, 1)
+    assert list(await queue.get_batch()) == [2, 3]
+
+def test_prepared_rbmsg_encodes_once():
+    prepared = PreparedRbmsg({"sid": "1", "codeid": 0, "msg": {"num": 1}})
+    encoded_bytes = prepared.encoded_bytes
+    assert encoded_bytes == b'{"sid":"1","codeid":0,"msg":{"num":1}}'
+    # all the cons are given the same buffer
+    assert prepared.encoded_bytes is encoded_bytes
+    assert prepared.encoded == encoded_bytes.decode()
+    assert prepared.encoded is prepared.encoded
+
+async def test_batch_queue_put_many():
+    queue: BatchQueue[int] = BatchQueue(3)
+    queue.put_nowait(1)
+    queue.put_many_nowait([2, 3])
+    with pytest.raises(QueueFull):
+        queue.put_many_nowait([4])
+
+    assert list(await queue.get_batch(2)) == [1, 2]
+    # doesn't fit as a whole => nothing is put
+    with pytest.raises(QueueFull):
+        queue.put_many_nowait([4, 5, 6])
+    assert list(await queue.get_batch()) == [3]
+
+async def test_batch_queue_put_many_waits():
+    queue: BatchQueue[int] = BatchQueue(2)
+    await queue.put_many([1])
+    put_task = asyncio.create_task(queue.put_many([2, 3]))
+    await asyncio.sleep(0)
+    assert not put_task.done()
+
+    assert list(await queue.get_batch()) == [1, 2]
+    await asyncio.wait_for(put_task, 1)
+    assert list(await queue.get_batch()) == [3]
+
+def test_transport_url():
+    transport = Transport(
+        is_server=True,
+        con_type=Tcp,
+        protocol="tcp",
+        host="localhost",
+        port=1)
+    assert transport.url == "tcp://localhost:1/"
+    assert transport.model_copy(update={"port": 2}).url == "tcp://localhost:2/"
+    transport.port = 3
+    assert transport.url == "tcp://localhost:3/"
@@ -7,17 +7,28 @@ Yon server implementation for Python.
 
 import asyncio
 import contextlib
-import functools
+import dataclasses
+import itertools
+import sys
 import typing
-from asyncio import Queue
+import weakref
 from collections.abc import Awaitable, Callable
-from contextvars import ContextVar
-from inspect import isclass, signature
+from concurrent.futures import Executor
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from inspect import (
+    isawaitable,
+    isclass,
+    iscoroutinefunction,
+    signature,
+)
+from types import MappingProxyType
 from typing import (
     Any,
     ClassVar,
     Generic,
     Iterable,
+    Mapping,
     Protocol,
     runtime_checkable,
 )
@@ -27,25 +38,27 @@ from ryz.code import Code, Coded
 from ryz.err import AlreadyProcessedErr, ErrDto, NotFoundErr, ValErr
 from ryz.err_utils import create_err_dto
 from ryz.log import log
-from ryz.ptr import Ptr
 from ryz.res import Err, Ok, Res, Result, UnwrapErr, aresultify, valerr
 from ryz.singleton import Singleton
-from ryz.uuid import uuid4
 
 from yon.server._msg import (
     Bmsg,
     Msg,
     TMsg_contra,
     Welcome,
+    make_net_rbmsg,
     ok,
 )
 from yon.server._rpc import EmptyRpcArgs, RpcFn, RpcRecv, RpcSend
+from yon.server._tcp import Tcp, TcpProtocol
 from yon.server._transport import (
     ActiveTransport,
+    BatchQueue,
     Con,
     ConArgs,
     OnRecvFn,
     OnSendFn,
+    PreparedRbmsg,
     Transport,
 )
 from yon.server._udp import Udp
@@ -74,6 +87,8 @@ __all__ = [
     "Transport",
     "Ws",
     "Udp",
+    "Tcp",
+    "TcpProtocol",
     "OnSendFn",
     "OnRecvFn",
 
@@ -81,9 +96,24 @@ __all__ = [
     "InterruptPipeline",
     "SkipMe",
 
-    "sub"
+    "sub",
+    "cpu_bound",
+    "install_uvloop"
 ]
 
+def _create_eager_task(coro: typing.Coroutine) -> asyncio.Task:
+    """
+    Creates task which runs until it's first suspension right away, instead
+    of waiting for the next loop iteration.
+
+    Eager start is available since python 3.12, for earlier versions
+    a usual task is created.
+    """
+    if sys.version_info >= (3, 12):
+        return asyncio.Task(
+            coro, loop=asyncio.get_running_loop(), eager_start=True)
+    return asyncio.create_task(coro)
+
 class StaticCodeid:
     """
     Static codeids defined by Yon protocol.
@@ -98,19 +128,117 @@ class SubFn(Protocol, Generic[TMsg_contra]):
 
 def sub(msgtype: type[TMsg_contra]):
     def wrapper(target: SubFn[TMsg_contra]):
-        Bus.subfn_init_queue.add((msgtype, target))
-        def inner(*args, **kwargs) -> Any:
-            return target(*args, **kwargs)
-        return inner
+        # first decoration wins, repeated ones don't change the order
+        Bus.subfn_init_queue.setdefault((msgtype, id(target)), target)
+        # the target itself is returned, so it stays picklable by it's
+        # module attribute, e.g. for cpu_bound fns in process pools
+        return target
     return wrapper
 
+_cpu_bound_fns: weakref.WeakSet[Callable] = weakref.WeakSet()
+_rpcfn_to_msgtype: weakref.WeakKeyDictionary[Callable, Any] = (
+    weakref.WeakKeyDictionary())
+
+def _get_rpcfn_msgtype(fn: Callable) -> Any | None:
+    """
+    Gets annotation of rpc fn's "msg" arg, or None if there is no such arg.
+
+    Results are cached per fn, and the annotations are read directly, the
+    costly signature building is only a fallback.
+    """
+    try:
+        msgtype = _rpcfn_to_msgtype.get(fn, None)
+    except TypeError:
+        # not weakrefable callables are just not cached
+        return _read_rpcfn_msgtype(fn)
+    if msgtype is not None:
+        return msgtype
+
+    msgtype = _read_rpcfn_msgtype(fn)
+    if msgtype is not None:
+        _rpcfn_to_msgtype[fn] = msgtype
+    return msgtype
+
+def _read_rpcfn_msgtype(fn: Callable) -> Any | None:
+    annotations = getattr(fn, "__annotations__", None)
+    if annotations and "msg" in annotations:
+        return annotations["msg"]
+    msg_param = signature(fn).parameters.get("msg")
+    if msg_param is None:
+        return None
+    return msg_param.annotation
+
+def cpu_bound(target: Callable) -> Callable:
+    """
+    Marks sync subfn or rpc fn as cpu-bound.
+
+    Such functions are called in ``BusCfg.cpu_executor`` instead of
+    the event loop, so their computations don't stall the bus. Yon ctx is not
+    available inside them.
+
+    Can be placed either under or above ``sub`` or ``rpc`` decorators. These
+    decorators return the fn itself, so with process pool executor the fn is
+    pickled by it's module attribute as usual.
+
+    Raises:
+        TypeError: the fn is async - the executor would only create it's
+            coroutine without awaiting it.
+    """
+    if iscoroutinefunction(target):
+        raise TypeError(f"cpu-bound fn {target} must be sync")
+    _cpu_bound_fns.add(target)
+    # rpc decorator regs the fn right away, so if it's placed under this
+    # decorator, the already regd fn is switched to be offloaded
+    rpckey_to_fn = Bus._rpckey_to_fn # noqa: SLF001
+    for key, (fn, msgtype, validate, _) in rpckey_to_fn.items():
+        if fn is target:
+            rpckey_to_fn[key] = (
+                fn, msgtype, validate, _offload_if_cpu_bound(fn))
+    return target
+
+def _offload_if_cpu_bound(fn: Callable) -> Callable:
+    """
+    Returns the fn itself, or if it's marked with ``cpu_bound``, async fn
+    calling it in the bus's cpu executor.
+
+    Applied once per sub or rpc reg, so calls don't check cpu-boundness.
+    """
+    if fn not in _cpu_bound_fns:
+        return fn
+
+    async def run_in_executor(msg: Msg) -> Any:
+        # executor is resolved on call, since rpc fns can be regd before the
+        # bus is initialized
+        return await asyncio.get_running_loop().run_in_executor(
+            Bus.ie()._cfg.cpu_executor, fn, msg) # noqa: SLF001
+    return run_in_executor
+
+def install_uvloop() -> bool:
+    """
+    Installs uvloop event loop policy, if optional "uvloop" package is
+    available. It is installed with "uvloop" extra, e.g.
+    ``pip install yon[uvloop]``.
+
+    Must be called by the app before it's event loop is created, e.g. before
+    ``asyncio.run``. The bus is initialized inside an already running loop,
+    so it cannot replace the loop by itself.
+
+    Returns:
+        Whether uvloop is installed.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
 # placed here and not at _rpc.py to avoid circulars
 def rpc(key: str):
     def wrapper(target: RpcFn):
         Bus.reg_rpc(key, target).eject()
-        def inner(*args, **kwargs) -> Any:
-            return target(*args, **kwargs)
-        return inner
+        # the target itself is returned, see ``sub``
+        return target
     return wrapper
 
 class PubList(list[Msg]):
@@ -152,7 +280,26 @@ class InternalBusUnhandledErr(Exception):
             f"bus unhandled err: {err}"
         )
 
-class PubOpts(BaseModel):
+# codes are static, so they're resolved once instead of calling code() per
+# msg
+_RPC_SEND_CODE = RpcSend.code()
+_RPC_RECV_CODE = RpcRecv.code()
+_WELCOME_CODE = Welcome.code()
+
+_CTX_MSID_LSID = "$ctx::msid"
+"""
+Lsid operator to use "msid" field of the ctx as lsid.
+"""
+
+_PER_MSG_LOG_V = 2
+"""
+Verbosity required for logs made per received or sent msg.
+"""
+
+# opts are created on every pub/sub, so they are plain frozen dataclasses -
+# no validation is needed, and default instances are safe to share
+@dataclass(slots=True, frozen=True)
+class PubOpts:
     subfn: SubFn | None = None
 
     target_consids: list[str] | None = None
@@ -186,14 +333,12 @@ class PubOpts(BaseModel):
     None, which means no timeout is set.
     """
 
-    class Config:
-        arbitrary_types_allowed = True
-
 MsgCondition = Callable[[Msg], Awaitable[bool]]
 MsgFilter = Callable[[Msg], Awaitable[Msg]]
 SubFnRetvalFilter = Callable[[SubFnRetval], Awaitable[SubFnRetval]]
 
-class SubOpts(BaseModel):
+@dataclass(slots=True, frozen=True)
+class SubOpts:
     recv_last_msg: bool = True
     """
     Whether to receive last stored msg with the same body code.
@@ -210,7 +355,33 @@ class SubOpts(BaseModel):
     inp_filters: Iterable[MsgFilter] | None = None
     out_filters: Iterable[SubFnRetvalFilter] | None = None
 
-_yon_ctx = ContextVar("yon", default={})
+# ctx mappings are never mutated, a changed ctx is set as a new mapping, so
+# readers don't need to copy it
+_yon_ctx: ContextVar[Mapping[str, Any]] = ContextVar(
+    "yon", default=MappingProxyType({}))
+
+def _set_ctx_for_bmsg(bmsg: Bmsg) -> Token[Mapping[str, Any]]:
+    """
+    Sets ctx for handling of the bmsg.
+
+    Returns:
+        Token to reset the ctx once the handling is done.
+    """
+    consid = bmsg.skip__consid
+    ctx_dict = (
+        {"msid": bmsg.sid, "consid": consid}
+        if consid
+        else {"msid": bmsg.sid})
+    # subfn calls reset their ctx, so the current ctx is empty for msgs
+    # coming from the net, and is only kept for msgs published during
+    # another subfn or rpc call
+    cur_ctx = _yon_ctx.get()
+    if cur_ctx:
+        ctx_dict = {**cur_ctx, **ctx_dict}
+        # subfn lsid is changed for a single subfn call, it must not affect
+        # handling of msgs published during that call
+        ctx_dict.pop("subfn_lsid", None)
+    return _yon_ctx.set(MappingProxyType(ctx_dict))
 
 @runtime_checkable
 class CtxManager(Protocol):
@@ -256,22 +427,66 @@ class BusCfg(BaseModel):
 
     consider_sub_decorators: bool = True
 
+    cpu_executor: Executor | None = None
+    """
+    Executor to call functions marked with ``cpu_bound`` in.
+
+    None means the event loop's default executor.
+    """
+
     class Config:
         arbitrary_types_allowed = True
 
+def _is_rpc_type(t: type) -> bool:
+    # rpc types themselves are checked by identity, only other types go
+    # through the metaclass subclass check
+    return t is RpcSend or t is RpcRecv or issubclass(t, (RpcSend, RpcRecv))
+
+_subsid_counter = itertools.count()
+"""
+Subsids never leave the process, so a counter is enough to keep them
+unique.
+"""
+
+class _Unsub:
+    """
+    Unsubscribe function returned from ``Bus.sub``.
+    """
+    __slots__ = ("_bus", "subsid")
+
+    def __init__(self, bus: "Bus", subsid: str) -> None:
+        self._bus = bus
+        self.subsid = subsid
+
+    def __call__(self) -> Awaitable[Res[None]]:
+        return self._bus.unsub(self.subsid)
+
 class Bus(Singleton):
     """
     Yon server bus implementation.
     """
-    subfn_init_queue: ClassVar[set[tuple[type[Msg], SubFn]]] = set()
+    subfn_init_queue: ClassVar[dict[tuple[type[Msg], int], SubFn]] = {}
     """
-    Queue of subscription functions to be subscribed on bus's initialization.
+    Queue of subscription functions to be subscribed on bus's initialization,
+    in decoration order. Keyed by msg type and subfn id, so the subfns don't
+    need to be hashed.
 
     Is not cleared, so after bus recreation, it's no need to reimport all subs.
 
     Using this queue can be disabled by cfg.consider_sub_decorators.
     """
-    _rpckey_to_fn: ClassVar[dict[str, tuple[RpcFn, type[BaseModel]]]] = {}
+    _rpckey_to_fn: ClassVar[dict[
+        str,
+        tuple[
+            RpcFn,
+            type[BaseModel],
+            Callable[[Any], BaseModel],
+            Callable]]] = {}
+    """
+    Rpc fns with their msg types, bound msg validators and callables to
+    run the fns (offloaded to executor for cpu-bound ones), so each call
+    needs a single lookup.
+    """
     DEFAULT_TRANSPORT: ClassVar[Transport] = Transport(
         is_server=True,
         con_type=Ws,
@@ -291,28 +506,28 @@ class Bus(Singleton):
         self._is_initd = False
 
     def get_con_tokens(
-            self, consid: str) -> Res[list[str]]:
+            self, consid: str) -> Res[frozenset[str]]:
         con = self._sid_to_con.get(consid, None)
         if con is None:
             return valerr(f"no con with sid {consid}")
         return Ok(con.get_tokens())
 
     def set_con_tokens(
-            self, consid: str, tokens: list[str]) -> Res[None]:
+            self, consid: str, tokens: Iterable[str]) -> Res[None]:
         con = self._sid_to_con.get(consid, None)
         if con is None:
             return valerr(f"no con with sid {consid}")
         con.set_tokens(tokens)
         return Ok(None)
 
-    def get_ctx_con_tokens(self) -> Res[list[str]]:
+    def get_ctx_con_tokens(self) -> Res[frozenset[str]]:
         consid_res = self.get_ctx_consid()
         if isinstance(consid_res, Err):
             return consid_res
         return self.get_con_tokens(consid_res.okval)
 
     def set_ctx_con_tokens(
-            self, tokens: list[str]) -> Res[None]:
+            self, tokens: Iterable[str]) -> Res[None]:
         consid_res = self.get_ctx_consid()
         if isinstance(consid_res, Err):
             return consid_res
@@ -328,25 +543,64 @@ class Bus(Singleton):
             del self._sid_to_con[consid]
         return await aresultify(con.close())
 
-    def get_ctx(self) -> dict:
-        return _yon_ctx.get().copy()
+    def get_ctx(self) -> Mapping[str, Any]:
+        return _yon_ctx.get()
 
     async def init(self, cfg: BusCfg = BusCfg()):
         if self._is_initd:
             return
 
         self._cfg = cfg
+        # pydantic validates iterables to one-shot iterators, so the globals
+        # are materialized once to be reused for each sub
+        self._global_subfn_inp_filters = tuple(
+            cfg.global_subfn_inp_filters or ())
+        self._global_subfn_conditions = tuple(
+            cfg.global_subfn_conditions or ())
+        self._global_subfn_out_filters = tuple(
+            cfg.global_subfn_out_filters or ())
+        # ctxfn presence doesn't change after init, so the variant is chosen
+        # once instead of checking it on every subfn call
+        self._run_subfn: Callable[[SubFn, Bmsg], Awaitable[Any]] = (
+            self._run_subfn_plain
+            if cfg.sub_ctxfn is None
+            else self._run_subfn_with_ctxfn)
+        self._run_rpcfn: Callable[
+            [RpcFn, Callable[[Any], BaseModel], RpcSend], Awaitable[Any]] = (
+            self._run_rpcfn_plain
+            if cfg.rpc_ctxfn is None
+            else self._run_rpcfn_with_ctxfn)
 
         self._init_transports()
 
         self._sid_to_con: dict[str, Con] = {}
 
-        self._subsid_to_code: dict[str, str] = {}
-        self._subsid_to_subfn: dict[str, SubFn] = {}
-        self._code_to_subfns: dict[str, list[SubFn]] = {}
+        self._subsid_to_sub: dict[str, tuple[str, SubFn]] = {}
+        """
+        Code and subfn of each sub, kept together so sub/unsub touch a single
+        entry.
+        """
+        self._code_to_subfns: dict[str, tuple[SubFn, ...]] = {}
+        """
+        Subfns are kept in tuples, rebuilt on sub/unsub, so the pub path can
+        iterate them without copying.
+        """
         self._code_to_last_mbody: dict[str, Msg] = {}
+        self._type_to_regd_code: dict[type, str] = {}
+        """
+        Codes of already published msg types. Cleared on codes update.
+        """
 
-        self._preserialized_welcome_msg: dict = {}
+        self._prepared_welcome = PreparedRbmsg({})
+        """
+        Welcome rbmsg shared by all cons, so it's encoded once per codes
+        update, not once per con.
+        """
+        self._rpc_recv_codeid: int | None = None
+        """
+        Codeid of rpc responses, resolved on codes update instead of per
+        response.
+        """
 
         self._lsid_to_subfn: dict[str, SubFn] = {}
         """
@@ -358,6 +612,18 @@ class Bus(Singleton):
         self._is_post_initd = False
 
         self._rpc_tasks: set[asyncio.Task] = set()
+        # bound once instead of per spawned rpc
+        self._discard_rpc_task = self._rpc_tasks.discard
+
+        self._code_to_net_handler: dict[
+            str, Callable[[Bmsg], asyncio.Task | None]] = {
+            _RPC_RECV_CODE: self._reject_rpc_recv,
+            _RPC_SEND_CODE: self._spawn_rpc_call,
+        }
+        """
+        Handlers of net msgs which don't go to the inner bus. Looked up by
+        msg code, so usual msgs cost a single dict miss.
+        """
 
         reg_types = [] if cfg.reg_types is None else cfg.reg_types
         (await self.reg_types([
@@ -391,7 +657,7 @@ class Bus(Singleton):
         ])).eject()
 
         if self._cfg.consider_sub_decorators:
-            for msgtype, subfn in self.subfn_init_queue:
+            for (msgtype, _), subfn in self.subfn_init_queue.items():
                 (await self.sub(msgtype, subfn)).eject()
 
     @property
@@ -421,6 +687,7 @@ class Bus(Singleton):
         if not self._is_initd:
             return valerr("bus should be initialized")
         upd_res = await Code.upd(types, self.DEFAULT_CODE_ORDER)
+        self._type_to_regd_code.clear()
         if isinstance(upd_res, Err):
             return upd_res
         return await self._set_welcome()
@@ -446,14 +713,12 @@ class Bus(Singleton):
             return Err(ValErr(f"rpc key {key} is already regd"))
 
         if msgtype is None:
-            sig = signature(fn)
-            msg_param = sig.parameters.get("msg")
-            if not msg_param:
+            msgtype = _get_rpcfn_msgtype(fn)
+            if msgtype is None:
                 return valerr(
                     f"rpc fn {fn} with key {key} must accept"
                     " \"msg: AnyBaseModel\" as it's sole argument"
                 )
-            msgtype = msg_param.annotation
         if msgtype is None:
             return valerr("rpc msg type cannot be None")
         if msgtype is BaseModel:
@@ -467,7 +732,11 @@ class Bus(Singleton):
                 f" of BaseModel, got {msgtype}"
             )
 
-        cls._rpckey_to_fn[key] = (fn, msgtype)
+        cls._rpckey_to_fn[key] = (
+            fn,
+            msgtype,
+            msgtype.model_validate,
+            _offload_if_cpu_bound(fn))
         return Ok(None)
 
     async def postinit(self):
@@ -483,9 +752,16 @@ class Bus(Singleton):
         if not bus._is_initd: # noqa: SLF001
             return
 
+        processors: list[asyncio.Task] = []
         for atransport in bus._con_type_to_atransport.values(): # noqa: SLF001
-            atransport.inp_queue_processor.cancel()
-            atransport.out_queue_processor.cancel()
+            processors.extend(atransport.inp_queue_processors)
+            processors.extend(atransport.out_queue_processors)
+        # unfinished rpc calls are stopped together with the processors
+        processors.extend(bus._rpc_tasks) # noqa: SLF001
+        for processor in processors:
+            processor.cancel()
+        # wait for the processors to actually stop
+        await asyncio.gather(*processors, return_exceptions=True)
 
         cls._rpckey_to_fn.clear()
         Code.destroy()
@@ -503,17 +779,18 @@ class Bus(Singleton):
                 " => close con")
             with contextlib.suppress(Exception):
                 await con.close()
-        atransport = typing.cast(ActiveTransport, atransport)
+            return
 
         if con.sid in self._sid_to_con:
             log.err("con with such sid already active => skip")
             return
 
         log.info(f"accept new con {con}", 2)
+        con.set_out_queue(atransport.out_queue)
         self._sid_to_con[con.sid] = con
 
         try:
-            await con.send(self._preserialized_welcome_msg)
+            await con.send_prepared(self._prepared_welcome)
             await self._read_ws(con, atransport)
         except Exception as err:
             await log.atrack(err, f"during con {con} main loop => close")
@@ -540,7 +817,9 @@ class Bus(Singleton):
 
         Args:
             subfn:
-                Function to fire once the messsage has arrived.
+                Function to fire once the messsage has arrived. Can be
+                a plain sync function, which is then called without
+                creating a coroutine.
             opts (optional):
                 Subscription options.
         Returns:
@@ -552,8 +831,8 @@ class Bus(Singleton):
         r = self._check_norpc_mbody(msgtype, "subscription")
         if isinstance(r, Err):
             return r
-        subsid = uuid4()
-        subfn = self._apply_opts_to_subfn(subfn, opts)
+        subsid = f"{next(_subsid_counter):x}"
+        subfn = self._apply_opts_to_subfn(_offload_if_cpu_bound(subfn), opts)
 
         code_res = Code.get_from_type(msgtype)
         if isinstance(code_res, Err):
@@ -563,31 +842,30 @@ class Bus(Singleton):
         if not Code.has_code(code):
             return valerr(f"code \"{code}\" is not regd")
 
-        if code not in self._code_to_subfns:
-            self._code_to_subfns[code] = []
-        self._code_to_subfns[code].append(subfn)
-        self._subsid_to_subfn[subsid] = subfn
-        self._subsid_to_code[subsid] = code
+        self._code_to_subfns[code] = (
+            *self._code_to_subfns.get(code, ()), subfn)
+        self._subsid_to_sub[subsid] = (code, subfn)
 
         if opts.recv_last_msg and code in self._code_to_last_mbody:
             last_body = self._code_to_last_mbody[code]
             await self._call_subfn(subfn, last_body)
 
-        return Ok(functools.partial(self.unsub, subsid))
+        return Ok(_Unsub(self, subsid))
 
     async def unsub(self, subsid: str) -> Res[None]:
-        if subsid not in self._subsid_to_code:
+        sub = self._subsid_to_sub.pop(subsid, None)
+        if sub is None:
             return Err(ValErr(f"sub with id {subsid} not found"))
-
-        assert self._subsid_to_code[subsid] in self._code_to_subfns
-
-        msg_type = self._subsid_to_code[subsid]
-
-        assert subsid in self._subsid_to_code, "all maps must be synced"
-        assert subsid in self._subsid_to_subfn, "all maps must be synced"
-        del self._subsid_to_code[subsid]
-        del self._subsid_to_subfn[subsid]
-        del self._code_to_subfns[msg_type]
+        code, subfn = sub
+        assert code in self._code_to_subfns, "all maps must be synced"
+
+        # only this sub's subfn is removed, other subs of the code are kept
+        subfns = list(self._code_to_subfns[code])
+        subfns.remove(subfn)
+        if subfns:
+            self._code_to_subfns[code] = tuple(subfns)
+        else:
+            del self._code_to_subfns[code]
         return Ok(None)
 
     async def unsub_many(
@@ -607,33 +885,31 @@ class Bus(Singleton):
 
         If the response is Exception, it is wrapped to res::Err.
         """
-        aevt = asyncio.Event()
-        ptr: Ptr[Msg] = Ptr(target=None)
+        fut: asyncio.Future[Msg] = asyncio.get_running_loop().create_future()
 
-        def wrapper(aevt: asyncio.Event, ptr: Ptr[Msg]):
-            async def fn(msg: Msg):
-                aevt.set()
-                ptr.target = msg
-            return fn
+        async def fn(msg: Msg):
+            # only the first response is taken
+            if not fut.done():
+                fut.set_result(msg)
 
         if opts.subfn is not None:
             log.warn("don't pass PubOpts.subfn to pubr, it gets overwritten")
-        opts.subfn = wrapper(aevt, ptr)
+        opts = dataclasses.replace(opts, subfn=fn)
         pub_res = await self.pub(msg, opts)
         if isinstance(pub_res, Err):
             return pub_res
         if opts.pubr_timeout is None:
-            await aevt.wait()
+            response = await fut
         else:
             try:
-                await asyncio.wait_for(aevt.wait(), opts.pubr_timeout)
+                response = await asyncio.wait_for(fut, opts.pubr_timeout)
             except asyncio.TimeoutError as err:
                 return Err(err)
 
-        if (isinstance(ptr.target, Exception)):
-            return Err(ptr.target)
+        if (isinstance(response, Exception)):
+            return Err(response)
 
-        return Ok(ptr.target)
+        return Ok(response)
 
     def get_ctx_key(self, key: str) -> Res[Any]:
         val = _yon_ctx.get().get(key, None)
@@ -659,9 +935,11 @@ class Bus(Singleton):
 
         Passed Result will be fetched for the value.
         """
-        if isinstance(msg, Ok):
+        # Ok and Err have no subclasses, so on the pub path they're checked
+        # by exact type, which is cheaper than isinstance for arbitrary msgs
+        if type(msg) is Ok:
             msg = msg.okval
-        elif isinstance(msg, Err):
+        elif type(msg) is Err:
             msg = msg.errval
 
         if isinstance(msg, Bmsg):
@@ -670,13 +948,13 @@ class Bus(Singleton):
             code = bmsg.skip__code
         else:
             msg_res = self._make_bmsg(msg, opts)
-            if isinstance(msg_res, Err):
+            if type(msg_res) is Err:
                 return msg_res
             bmsg = msg_res.okval
             code = bmsg.skip__code
 
-        r = self._check_norpc_mbody(bmsg, "publication")
-        if isinstance(r, Err):
+        r = self._check_norpc_mbody(msg, "publication")
+        if type(r) is Err:
             return r
 
         if opts.subfn is not None:
@@ -705,34 +983,41 @@ class Bus(Singleton):
         return body
 
     def _unpack_lsid(self, lsid: str | None) -> Res[str | None]:
-        if lsid == "$ctx::msid":
+        # operators are recognized by the first char, so usual lsids don't go
+        # through any further comparisons
+        if not lsid or lsid[0] != "$":
+            return Ok(lsid)
+        if lsid == _CTX_MSID_LSID:
             # by default we publish as response to current message, so we
             # use the current's message sid as linked sid
             msid_res = self.get_ctx_key("msid")
-            if isinstance(msid_res, Err):
+            if type(msid_res) is Err:
                 return msid_res
             lsid = msid_res.okval
             assert isinstance(lsid, str)
-        elif isinstance(lsid, str) and lsid.startswith("$"):
-            return valerr(f"unrecognized PubOpts.lsid operator: {lsid}")
-        return Ok(lsid)
+            return Ok(lsid)
+        return valerr(f"unrecognized PubOpts.lsid operator: {lsid}")
 
     def _make_bmsg(
         self,
         msg: Msg,
         opts: PubOpts = PubOpts()
     ) -> Res[Bmsg]:
-        code_res = Code.get_from_type(type(msg))
-        if isinstance(code_res, Err):
-            return code_res
-        code = code_res.okval
-        if not Code.has_code(code):
-            return valerr(f"code {code} is not registered")
+        msgtype = type(msg)
+        code = self._type_to_regd_code.get(msgtype, None)
+        if code is None:
+            code_res = Code.get_from_type(msgtype)
+            if type(code_res) is Err:
+                return code_res
+            code = code_res.okval
+            if not Code.has_code(code):
+                return valerr(f"code {code} is not registered")
+            self._type_to_regd_code[msgtype] = code
 
         msg = self._unpack_err(msg, self._cfg.trace_errs_on_pub)
 
         lsid_res = self._unpack_lsid(opts.lsid)
-        if isinstance(lsid_res, Err):
+        if type(lsid_res) is Err:
             return lsid_res
         lsid = lsid_res.okval
 
@@ -742,7 +1027,7 @@ class Bus(Singleton):
         else:
             # try to get ctx consid, otherwise left as none
             consid_res = self.get_ctx_key("consid")
-            if isinstance(consid_res, Ok):
+            if type(consid_res) is Ok:
                 assert isinstance(consid_res.okval, str)
                 target_consids = [consid_res.okval]
 
@@ -761,40 +1046,70 @@ class Bus(Singleton):
 
         if opts.send_to_net:
             await self._pub_bmsg_to_net(bmsg)
-        if opts.send_to_inner and bmsg.skip__code in self._code_to_subfns:
-            await self._send_to_inner_bus(bmsg)
+        if opts.send_to_inner:
+            subfns = self._code_to_subfns.get(bmsg.skip__code, None)
+            if subfns:
+                await self._send_to_inner_bus(bmsg, subfns)
         if bmsg.lsid:
             await self._send_as_linked(bmsg)
 
-    async def _send_to_inner_bus(self, msg: Bmsg):
-        subfns = self._code_to_subfns[msg.skip__code]
-        if not subfns:
+    async def _send_to_inner_bus(
+            self, msg: Bmsg, subfns: tuple[SubFn, ...]):
+        if len(subfns) == 1:
+            # failed subfn is handled the same way as in the gather below,
+            # so it doesn't break the publisher, e.g. inp queue processor
+            try:
+                await self._call_subfn(subfns[0], msg)
+            except Exception as err:
+                await log.atrack(err, f"during subfn {subfns[0]} call")
             return
-        for subfn in subfns:
-            await self._call_subfn(subfn, msg)
+        # subfns are independent, so they are called concurrently
+        rets = await asyncio.gather(
+            *[self._call_subfn(subfn, msg) for subfn in subfns],
+            return_exceptions=True)
+        for subfn, ret in zip(subfns, rets, strict=False):
+            if isinstance(ret, Exception):
+                await log.atrack(ret, f"during subfn {subfn} call")
 
     async def _pub_bmsg_to_net(self, bmsg: Bmsg):
         if bmsg.skip__target_consids:
             rbmsg = (await bmsg.serialize_to_net()).unwrap_or(None)
             if rbmsg is None:
                 return
-            await self._pub_rbmsg_to_net(rbmsg, bmsg.skip__target_consids)
-
-    async def _pub_rbmsg_to_net(self, rbmsg: dict, consids: Iterable[str]):
+            # all recipients share the same prepared msg, so it's encoded once
+            await self._pub_prepared_to_net(
+                PreparedRbmsg(rbmsg), bmsg.skip__target_consids)
+
+    async def _pub_prepared_to_net(
+            self, prepared: PreparedRbmsg, consids: Iterable[str]):
+        sid_to_con = self._sid_to_con
+        # recipients are grouped by transport's out queue, so each queue
+        # gets all it's items at once
+        queue_to_items: dict[
+            BatchQueue[tuple[Con, PreparedRbmsg]],
+            list[tuple[Con, PreparedRbmsg]]] = {}
         for consid in consids:
-            if consid not in self._sid_to_con:
+            con = sid_to_con.get(consid, None)
+            if con is None:
                 log.err(
-                    f"no con with id {consid} for rbmsg {rbmsg}"
+                    f"no con with id {consid} for rbmsg {prepared.rbmsg}"
                     " => skip")
                 continue
-            con = self._sid_to_con[consid]
-            con_type = type(con)
-            # if we have con in self._sid_to_con, we must have transport
-            if con_type not in self._con_type_to_atransport:
-                log.err("broken state of con_type_to_atransport => skip")
+            # if we have con in self._sid_to_con, it must have out queue
+            out_queue = con.get_out_queue()
+            if out_queue is None:
+                log.err(f"broken state of con {con} out queue => skip")
                 continue
-            atransport = self._con_type_to_atransport[con_type]
-            await atransport.out_queue.put((con, rbmsg))
+            queue_to_items.setdefault(out_queue, []).append((con, prepared))
+
+        puts = [
+            out_queue.put_many(items)
+            for out_queue, items in queue_to_items.items()]
+        if len(puts) == 1:
+            await puts[0]
+        elif puts:
+            # a full out queue of one transport doesn't hold back the others
+            await asyncio.gather(*puts)
 
     async def _send_as_linked(self, msg: Bmsg):
         if not msg.lsid:
@@ -809,48 +1124,59 @@ class Bus(Singleton):
         del self._lsid_to_subfn[lsid]
         return True
 
-    def _gen_ctx_dict_for_msg(self, bmsg: Bmsg) -> dict:
-        ctx_dict = _yon_ctx.get().copy()
-
-        ctx_dict["msid"] = bmsg.sid
-        if bmsg.skip__consid:
-            ctx_dict["consid"] = bmsg.skip__consid
-
-        return ctx_dict
-
     async def _call_subfn(self, subfn: SubFn, bmsg: Bmsg):
         """
         Calls subfn and pubs any response captured (including errors).
 
         Note that even None response is published as ok(None).
         """
-        _yon_ctx.set(self._gen_ctx_dict_for_msg(bmsg))
+        # single subfn is called inline, in the task of the publisher, so
+        # the ctx is reset afterwards to not leak to the publisher's next
+        # msgs
+        ctx_token = _set_ctx_for_bmsg(bmsg)
+        try:
+            retval = await self._run_subfn(subfn, bmsg)
 
-        if self._cfg.sub_ctxfn is not None:
-            try:
-                ctx_manager = (await self._cfg.sub_ctxfn(bmsg)).eject()
-            except Exception as err:
-                await log.atrack(
-                    err, f"rpx ctx manager retrieval for body {bmsg.msg}")
+            vals = self._parse_subfn_retval(subfn, retval)
+            if not vals:
                 return
-            async with ctx_manager:
-                retval = await subfn(bmsg.msg)
-        else:
-            retval = await subfn(bmsg.msg)
 
-        vals = self._parse_subfn_retval(subfn, retval)
-        if not vals:
-            return
+            # by default all subsriber's body are intended to be linked to
+            # initial message, so we attach this message ctx msid
+            lsid = _yon_ctx.get().get("subfn_lsid", _CTX_MSID_LSID)
+            pub_opts = PubOpts(lsid=lsid)
+            for val in vals:
+                if val is None:
+                    val = ok()
+                await (await self.pub(val, pub_opts)).atrack(
+                    f"during subfn {subfn} retval publication")
+        finally:
+            _yon_ctx.reset(ctx_token)
 
-        # by default all subsriber's body are intended to be linked to
-        # initial message, so we attach this message ctx msid
-        lsid = _yon_ctx.get().get("subfn_lsid", "$ctx::msid")
-        pub_opts = PubOpts(lsid=lsid)
-        for val in vals:
-            if val is None:
-                val = ok()
-            await (await self.pub(val, pub_opts)).atrack(
-                f"during subfn {subfn} retval publication")
+    async def _run_subfn_plain(self, subfn: SubFn, bmsg: Bmsg) -> Any:
+        return await self._call_fn(subfn, bmsg.msg)
+
+    async def _run_subfn_with_ctxfn(self, subfn: SubFn, bmsg: Bmsg) -> Any:
+        assert self._cfg.sub_ctxfn is not None
+        try:
+            ctx_manager = (await self._cfg.sub_ctxfn(bmsg)).eject()
+        except Exception as err:
+            await log.atrack(
+                err, f"rpx ctx manager retrieval for body {bmsg.msg}")
+            # nothing to publish
+            return SkipMe()
+        async with ctx_manager:
+            return await self._call_fn(subfn, bmsg.msg)
+
+    async def _call_fn(self, fn: Callable, msg: Msg) -> Any:
+        """
+        Calls subfn or rpc fn, which can be either sync or async.
+        """
+        ret = fn(msg)
+        # sync fns have nothing to await, so they're done right away
+        if isawaitable(ret):
+            return await ret
+        return ret
 
     def _parse_subfn_retval(
             self,
@@ -858,9 +1184,9 @@ class Bus(Singleton):
             retval: SubFnRetval) -> Iterable[Msg]:
         # unpack here, though it can be done inside pub(), but we want to
         # process iterables here
-        if isinstance(retval, Ok):
+        if type(retval) is Ok:
             retval = retval.okval
-        if isinstance(retval, Err):
+        if type(retval) is Err:
             retval = retval.errval
 
         if isinstance(retval, SkipMe):
@@ -887,8 +1213,7 @@ class Bus(Singleton):
 
         Useful at ``SubOpts.out_filters``, see ``disable_subfn_lsid``.
         """
-        ctx_dict = _yon_ctx.get().copy()
-        ctx_dict["subfn__lsid"] = lsid
+        _yon_ctx.set(MappingProxyType({**_yon_ctx.get(), "subfn_lsid": lsid}))
 
     def _check_norpc_mbody(
             self, body: Msg | type[Msg], disp_ctx: str) -> Res[None]:
@@ -896,14 +1221,7 @@ class Bus(Singleton):
         Since rpc msgs cannot participate in actions like "sub" and "pub",
         we have a separate fn to check this.
         """
-        iscls = isclass(body)
-        if (
-            (
-                iscls
-                and (issubclass(body, RpcSend) or issubclass(body, RpcRecv)))
-            or (
-                not iscls
-                and (isinstance(body, (RpcSend, RpcRecv))))):
+        if _is_rpc_type(body if isclass(body) else type(body)):
             return Err(ValErr(
                 f"mbody {body} in context of \"{disp_ctx}\" cannot be"
                 " associated with rpc"))
@@ -911,21 +1229,19 @@ class Bus(Singleton):
 
     def _apply_opts_to_subfn(
             self, subfn: SubFn, opts: SubOpts) -> SubFn:
-        async def wrapper(msg: Msg) -> Any:
-            # globals are applied before locals
-            inp_filters = [
-                *(self._cfg.global_subfn_inp_filters or []),
-                *(opts.inp_filters or [])
-            ]
-            conditions = [
-                *(self._cfg.global_subfn_conditions or []),
-                *(opts.conditions or [])
-            ]
-            out_filters = [
-                *(self._cfg.global_subfn_out_filters or []),
-                *(opts.out_filters or [])
-            ]
+        # pipelines are composed once per sub, globals are applied before
+        # locals
+        inp_filters = (
+            *self._global_subfn_inp_filters, *(opts.inp_filters or ()))
+        conditions = (
+            *self._global_subfn_conditions, *(opts.conditions or ()))
+        out_filters = (
+            *self._global_subfn_out_filters, *(opts.out_filters or ()))
+        if not inp_filters and not conditions and not out_filters:
+            # nothing to apply, so the subfn is called directly
+            return subfn
 
+        async def wrapper(msg: Msg) -> Any:
             for f in inp_filters:
                 msg = await f(msg)
                 if isinstance(msg, InterruptPipeline):
@@ -937,7 +1253,7 @@ class Bus(Singleton):
                 if not flag:
                     return SkipMe()
 
-            retbody = await subfn(msg)
+            retbody = await self._call_fn(subfn, msg)
 
             for f in out_filters:
                 retbody = await f(retbody)
@@ -961,120 +1277,245 @@ class Bus(Singleton):
             ) from err
 
     async def _read_ws(self, con: Con, atransport: ActiveTransport):
+        max_batch_size = atransport.transport.max_inp_batch_size
         async for rbmsg in con:
-            log.info(f"receive: {rbmsg}", 2)
-            atransport.inp_queue.put_nowait((con, rbmsg))
+            # check verbosity before formatting, the rbmsg can be big
+            if log.std_verbosity >= _PER_MSG_LOG_V:
+                log.info(f"receive: {rbmsg}", _PER_MSG_LOG_V)
+            # plain tuples are used on purpose: cpython recycles small tuples
+            # via it's freelist, which is cheaper than any pool of python
+            # objects
+            batch = [(con, rbmsg)]
+            # msgs already received by the con are put together, so the inp
+            # queue processor is woken up once for them
+            while max_batch_size <= 0 or len(batch) < max_batch_size:
+                next_rbmsg = con.recv_nowait()
+                if next_rbmsg is None:
+                    break
+                if log.std_verbosity >= _PER_MSG_LOG_V:
+                    log.info(f"receive: {next_rbmsg}", _PER_MSG_LOG_V)
+                batch.append((con, next_rbmsg))
+            atransport.inp_queue.put_many_nowait(batch)
 
     async def _process_inp_queue(
             self,
             transport: Transport,
-            queue: Queue[tuple[Con, dict]]):
+            queue: BatchQueue[tuple[Con, dict]],
+            recv_sem: asyncio.Semaphore | None):
+        # transport and cfg don't change during processor lifetime
+        max_batch_size = transport.max_inp_batch_size
+        on_recv = transport.on_recv
+        is_log_recv = self._cfg.log_net_recv
         while True:
-            con, rbmsg = await queue.get()
-            if self._cfg.log_net_recv:
-                log.info(f"NET::RECV | {con.sid} | {rbmsg}")
-            if transport.on_recv:
-                with contextlib.suppress(Exception):
-                    # we don't pass whole con to avoid control leaks
-                    await transport.on_recv(con.sid, rbmsg)
-            bmsg = await self._parse_rbmsg(rbmsg, con)
-            if isinstance(bmsg, Err):
-                await bmsg.atrack()
-                continue
-            await self._accept_net_bmsg(bmsg.okval)
+            if recv_sem is not None:
+                # acquire before taking msgs, so under load the msgs stay in
+                # the queue instead of spawning more work
+                await recv_sem.acquire()
+            is_first = True
+            # wake up once per batch instead of once per msg
+            for con, rbmsg in await queue.get_batch(max_batch_size):
+                if recv_sem is not None and not is_first:
+                    # doesn't suspend unless the limit is reached
+                    await recv_sem.acquire()
+                is_first = False
+                rpc_task: asyncio.Task | None = None
+                try:
+                    rpc_task = await self._process_inp_rbmsg(
+                        con, rbmsg, on_recv, is_log_recv)
+                finally:
+                    if recv_sem is not None:
+                        if rpc_task is None:
+                            recv_sem.release()
+                        else:
+                            # spawned rpc holds the slot until it's done
+                            rpc_task.add_done_callback(
+                                lambda _: recv_sem.release())
+
+    async def _process_inp_rbmsg(
+            self,
+            con: Con,
+            rbmsg: dict,
+            on_recv: OnRecvFn | None,
+            is_log_recv: bool) -> asyncio.Task | None:
+        if is_log_recv:
+            log.info(f"NET::RECV | {con.sid} | {rbmsg}")
+        if on_recv is not None:
+            # plain try instead of contextlib.suppress, which would create
+            # a context manager per msg
+            try: # noqa: SIM105
+                # we don't pass whole con to avoid control leaks
+                await on_recv(con.sid, rbmsg)
+            except Exception: # noqa: S110
+                pass
+        bmsg = await self._parse_rbmsg(rbmsg, con)
+        if type(bmsg) is Err:
+            await bmsg.atrack()
+            return None
+        return await self._accept_net_bmsg(bmsg.okval)
 
     async def _process_out_queue(
             self,
             transport: Transport,
-            queue: Queue[tuple[Con, dict]]):
+            queue: BatchQueue[tuple[Con, PreparedRbmsg]]):
+        # transport and cfg don't change during processor lifetime
+        max_batch_size = transport.max_out_batch_size
+        on_send = transport.on_send
+        is_log_send = self._cfg.log_net_send
         while True:
-            con, rbmsg = await queue.get()
+            # wake up once per batch instead of once per msg
+            batch = await queue.get_batch(max_batch_size)
+            con_to_prepareds: dict[Con, list[PreparedRbmsg]] = {}
+            for con, prepared in batch:
+                con_to_prepareds.setdefault(con, []).append(prepared)
+            if len(con_to_prepareds) == 1:
+                con, prepareds = con_to_prepareds.popitem()
+                await self._send_to_con(
+                    con, prepareds, on_send, is_log_send)
+                continue
+            # cons don't depend on each other, so their writes are
+            # overlapped, while each con still gets it's msgs in order
+            await asyncio.gather(*[
+                self._send_to_con(con, prepareds, on_send, is_log_send)
+                for con, prepareds in con_to_prepareds.items()])
 
-            if self._cfg.log_net_send:
+    async def _send_to_con(
+            self,
+            con: Con,
+            prepareds: list[PreparedRbmsg],
+            on_send: OnSendFn | None,
+            is_log_send: bool):
+        # check verbosity before formatting, the rbmsgs can be big
+        is_verbose = log.std_verbosity >= _PER_MSG_LOG_V
+        for prepared in prepareds:
+            rbmsg = prepared.rbmsg
+            if is_log_send:
                 log.info(f"NET::SEND | {con.sid} | {rbmsg}")
 
-            if transport.on_send:
-                with contextlib.suppress(Exception):
-                    await transport.on_send(con.sid, rbmsg)
+            if on_send is not None:
+                try: # noqa: SIM105
+                    await on_send(con.sid, rbmsg)
+                except Exception: # noqa: S110
+                    pass
 
-            log.info(f"send to consid {con.sid}: {rbmsg}", 2)
+            if is_verbose:
+                log.info(
+                    f"send to consid {con.sid}: {rbmsg}", _PER_MSG_LOG_V)
 
-            await con.send(rbmsg)
+            try:
+                await con.send_prepared(prepared)
+            except Exception as err:
+                # the rest of con's msgs are dropped, but the out queue
+                # processor stays alive for other cons
+                await log.atrack(err, f"during send to con {con} => skip")
+                return
 
-    async def _accept_net_bmsg(self, bmsg: Bmsg):
-        if isinstance(bmsg.msg, RpcRecv):
-            log.err(f"server bus won't accept RpcRecv messages, got {bmsg}")
-            return
-        elif isinstance(bmsg.msg, RpcSend):
-            # process rpc in a separate task to not block inp queue
-            # processing
-            task = asyncio.create_task(self._call_rpc(bmsg))
-            self._rpc_tasks.add(task)
-            task.add_done_callback(self._rpc_tasks.discard)
-            return
+    async def _accept_net_bmsg(self, bmsg: Bmsg) -> asyncio.Task | None:
+        """
+        Returns:
+            Task of spawned rpc call, if any.
+        """
+        handler = self._code_to_net_handler.get(bmsg.skip__code, None)
+        if handler is not None:
+            return handler(bmsg)
         # publish to inner bus with no duplicate net resending
         pub = await self.pub(bmsg, PubOpts(send_to_net=False))
-        if isinstance(pub, Err):
+        if type(pub) is Err:
             await (
                 await self.pub(
                     pub,
                     PubOpts(lsid=bmsg.lsid)
                 )
             ).atrack()
+        return None
+
+    def _reject_rpc_recv(self, bmsg: Bmsg) -> None:
+        log.err(f"server bus won't accept RpcRecv messages, got {bmsg}")
+
+    def _spawn_rpc_call(self, bmsg: Bmsg) -> asyncio.Task:
+        # process rpc in a separate task to not block inp queue processing
+        task = asyncio.create_task(self._call_rpc(bmsg))
+        self._rpc_tasks.add(task)
+        task.add_done_callback(self._discard_rpc_task)
+        return task
 
     async def _call_rpc(self, bmsg: Bmsg):
         msg = bmsg.msg
-        if msg.key not in self._rpckey_to_fn:
+        rpc = self._rpckey_to_fn.get(msg.key, None)
+        if rpc is None:
             log.err(f"no such rpc code {msg.key} for req {msg} => skip")
             return
-        fn, args_type = self._rpckey_to_fn[msg.key]
+        _, _, validate, fn = rpc
 
-        _yon_ctx.set(self._gen_ctx_dict_for_msg(bmsg))
+        _set_ctx_for_bmsg(bmsg)
 
-        ctx_manager: CtxManager | None = None
-        if self._cfg.rpc_ctxfn is not None:
-            try:
-                ctx_manager = (await self._cfg.rpc_ctxfn(msg)).eject()
-            except Exception as err:
-                await log.atrack(
-                    err,
-                    f"rpx ctx manager retrieval for body {msg} => skip")
-                return
         try:
-            if ctx_manager:
-                async with ctx_manager:
-                    res = await fn(args_type.model_validate(msg.data))
-            else:
-                res = await fn(args_type.model_validate(msg.data))
+            res = await self._run_rpcfn(fn, validate, msg)
         except Exception as err:
             await log.atrack(
                 err, f"rpcfn on req {msg} => wrap to usual RpcRecv")
             res = Err(err)
+        if isinstance(res, SkipMe):
+            return
 
         val: Any
-        if isinstance(res, Ok):
+        # Ok and Err have no subclasses, so exact type checks are enough
+        if type(res) is Ok:
             val = res.okval
-        elif isinstance(res, Err):
+        elif type(res) is Err:
             val = (await create_err_dto(res.errval)).eject()
-            val = typing.cast(ErrDto, val).model_dump(exclude={"stacktrace"})
+            val = typing.cast(ErrDto, val).model_dump()
+            # popped instead of model_dump(exclude=...), which builds the
+            # exclusion filter on each call
+            val.pop("stacktrace", None)
         else:
             log.err(
                 f"rpcfn on req {msg} returned non-res val {res} => skip")
             return
 
-        # val must be any serializable by pydantic object, so here we pass it
-        # directly to Msg, which will do serialization automatically under the
-        # hood
-        evt = Bmsg(
+        await self._send_rpc_response(bmsg, val)
+
+    async def _run_rpcfn_plain(
+            self,
+            fn: RpcFn,
+            validate: Callable[[Any], BaseModel],
+            msg: RpcSend) -> Any:
+        return await self._call_fn(fn, validate(msg.data))
+
+    async def _run_rpcfn_with_ctxfn(
+            self,
+            fn: RpcFn,
+            validate: Callable[[Any], BaseModel],
+            msg: RpcSend) -> Any:
+        assert self._cfg.rpc_ctxfn is not None
+        try:
+            ctx_manager = (await self._cfg.rpc_ctxfn(msg)).eject()
+        except Exception as err:
+            await log.atrack(
+                err, f"rpx ctx manager retrieval for body {msg} => skip")
+            # no response is sent
+            return SkipMe()
+        async with ctx_manager:
+            return await self._call_fn(fn, validate(msg.data))
+
+    async def _send_rpc_response(self, bmsg: Bmsg, val: Any):
+        # val must be any serializable by pydantic object. The response is
+        # made directly as rbmsg, since it's never validated as Bmsg or
+        # passed to the inner bus
+        rbmsg_res = await make_net_rbmsg(
+            _RPC_RECV_CODE,
+            val,
             lsid=bmsg.sid,
-            skip__target_consids=[bmsg.skip__consid],
-            skip__code=RpcRecv.code(),
-            # pass val directly to optimize
-            msg=val
-        )
+            codeid=self._rpc_recv_codeid)
+        if type(rbmsg_res) is Err:
+            await rbmsg_res.atrack(f"rpc response for req {bmsg.msg}")
+            return
+        if not bmsg.skip__consid:
+            log.err(f"rpc req {bmsg} has no consid => skip response")
+            return
         # we publish directly to the net since inner participants can't
         # subscribe to this
-        await self._pub_bmsg_to_net(evt)
+        await self._pub_prepared_to_net(
+            PreparedRbmsg(rbmsg_res.okval), (bmsg.skip__consid,))
 
     async def _parse_rbmsg(
         self, rbmsg: dict, con: Con
@@ -1083,9 +1524,7 @@ class Bus(Singleton):
         if not msid:
             return valerr("msg without sid")
         # msgs coming from net receive conection sid
-        rbmsg["skip__consid"] = con.sid
-        bmsg = await Bmsg.deserialize_from_net(rbmsg)
-        return bmsg
+        return await Bmsg.deserialize_from_net(rbmsg, con.sid)
 
     def _init_transports(self):
         self._con_type_to_atransport: dict[type[Con], ActiveTransport] = {}
@@ -1104,18 +1543,27 @@ class Bus(Singleton):
                     " => skip")
                 continue
 
-            inp_queue = Queue(transport.max_inp_queue_size)
-            out_queue = Queue(transport.max_out_queue_size)
-            inp_task = asyncio.create_task(self._process_inp_queue(
-                transport, inp_queue))
-            out_task = asyncio.create_task(self._process_out_queue(
-                transport, out_queue))
+            inp_queue = BatchQueue(transport.max_inp_queue_size)
+            out_queue = BatchQueue(transport.max_out_queue_size)
+            recv_sem = None
+            if transport.max_recv_concurrency > 0:
+                recv_sem = asyncio.Semaphore(transport.max_recv_concurrency)
+            # workers share the queues and the recv semaphore
+            inp_tasks = [
+                _create_eager_task(self._process_inp_queue(
+                    transport, inp_queue, recv_sem))
+                for _ in range(max(transport.inp_workers, 1))]
+            out_tasks = [
+                _create_eager_task(self._process_out_queue(
+                    transport, out_queue))
+                for _ in range(max(transport.out_workers, 1))]
             atransport = ActiveTransport(
                 transport=transport,
                 inp_queue=inp_queue,
                 out_queue=out_queue,
-                inp_queue_processor=inp_task,
-                out_queue_processor=out_task)
+                recv_sem=recv_sem,
+                inp_queue_processors=inp_tasks,
+                out_queue_processors=out_tasks)
             self._con_type_to_atransport[transport.con_type] = atransport
 
     async def _set_welcome(self) -> Res[None]:
@@ -1123,17 +1571,19 @@ class Bus(Singleton):
         if isinstance(codes_res, Err):
             return codes_res
         codes = codes_res.okval
+        self._rpc_recv_codeid = (
+            await Code.get_regd_codeid(_RPC_RECV_CODE)).unwrap_or(None)
         welcome = Welcome(codes=codes)
-        self._preserialized_welcome_msg = (await Bmsg(
-            skip__code=Welcome.code(),
+        self._prepared_welcome = PreparedRbmsg((await Bmsg(
+            skip__code=_WELCOME_CODE,
             msg=welcome
-        ).serialize_to_net()).eject()
+        ).serialize_to_net()).eject())
         rewelcome_res = await self._rewelcome_all_cons()
         if isinstance(rewelcome_res, Err):
             return rewelcome_res
         return Ok(None)
 
     async def _rewelcome_all_cons(self) -> Res[None]:
-        return Ok(await self._pub_rbmsg_to_net(
-            self._preserialized_welcome_msg,
+        return Ok(await self._pub_prepared_to_net(
+            self._prepared_welcome,
             self._sid_to_con.keys()))
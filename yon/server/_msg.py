@@ -1,12 +1,13 @@
 from typing import Any, Callable, Self, TypeVar
 
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 from ryz.code import Code
 from ryz.err import ValErr
 from ryz.err_utils import create_err_dto
 from ryz.log import log
 from ryz.res import Err, Ok, Res, resultify
-from ryz.uuid import uuid4
+
+from yon.server._transport import _IdPool
 
 Msg = Any
 TMsg = TypeVar("TMsg", bound=Msg)
@@ -15,6 +16,53 @@ TMsg_contra = TypeVar("TMsg_contra", contravariant=True, bound=Msg)
 Any custom body bus user interested in. Must be serializable and implement
 `code() -> str` method.
 """
+_MSG_ADAPTER: TypeAdapter[Msg] = TypeAdapter(Msg)
+
+async def make_net_rbmsg(
+    code: str,
+    msg: Msg,
+    *,
+    sid: str | None = None,
+    lsid: str | None = None,
+    codeid: int | None = None,
+) -> Res[dict]:
+    """
+    Makes rbmsg ready to be sent to the net, the same as
+    ``Bmsg.serialize_to_net`` does, but without constructing Bmsg.
+
+    If sid is not given, a new one is generated. If codeid is not given, it
+    is looked up by the code.
+    """
+    # the envelope schema is fixed, so it's assembled field by field. Only
+    # the body needs a generic dump
+    body = _MSG_ADAPTER.dump_python(msg)
+    # don't include empty collections in serialization
+    if getattr(body, "__len__", None) is not None and len(body) == 0:
+        body = None
+
+    # serialize exception to errdto
+    if isinstance(body, Exception):
+        err_dto_res = await create_err_dto(body)
+        if isinstance(err_dto_res, Err):
+            return err_dto_res
+        body = err_dto_res.okval.model_dump()
+        # stacktrace is not sent to the net
+        body.pop("stacktrace", None)
+
+    if codeid is None:
+        codeid_res = await Code.get_regd_codeid(code)
+        if type(codeid_res) is Err:
+            return codeid_res
+        codeid = codeid_res.okval
+
+    # keep the key order of the generic model dump
+    final: dict = {"sid": _IdPool.next() if sid is None else sid}
+    if lsid is not None:
+        final["lsid"] = lsid
+    if body is not None:
+        final["msg"] = body
+    final["codeid"] = codeid
+    return Ok(final)
 
 class Bmsg(BaseModel):
     """
@@ -63,7 +111,9 @@ class Bmsg(BaseModel):
 
     def __init__(self, **data):
         if "sid" not in data:
-            data["sid"] = uuid4()
+            # sids are used by clients as lsids, so they must stay
+            # unguessable, but are taken from the pooled random bytes
+            data["sid"] = _IdPool.next()
         super().__init__(**data)
 
     def __hash__(self) -> int:
@@ -73,26 +123,7 @@ class Bmsg(BaseModel):
     # todo: use orwynn indication funcs for serialize/deserialize methods
 
     async def serialize_to_net(self) -> Res[dict]:
-        final = self.model_dump()
-
-        body = final["msg"]
-        # don't include empty collections in serialization
-        if getattr(body, "__len__", None) is not None and len(body) == 0:
-            body = None
-
-        # serialize exception to errdto
-        if isinstance(body, Exception):
-            err_dto_res = await create_err_dto(body)
-            if isinstance(err_dto_res, Err):
-                return err_dto_res
-            body = err_dto_res.okval.model_dump(exclude={"stacktrace"})
-
-        codeid_res = await Code.get_regd_codeid(self.skip__code)
-        if isinstance(codeid_res, Err):
-            return codeid_res
-        final["codeid"] = codeid_res.okval
-
-        if "skip__consid" in final and final["skip__consid"] is not None:
+        if self.skip__consid is not None:
             # consids must exist only inside server bus, it's probably an err
             # if a msg is tried to be serialized with consid, but we will
             # throw a warning for now, and ofcourse del the field
@@ -100,29 +131,20 @@ class Bmsg(BaseModel):
                 "consids must exist only inside server bus, but it is tried"
                 f" to serialize msg {self} with consid != None => ignore"
             )
-
-        keys_to_del = self._get_keys_to_del_from_serialized(final)
-
-        for k in keys_to_del:
-            del final[k]
-
-        final["msg"] = body
-        if body is None and "msg" in final:
-            del final["msg"]
-        return Ok(final)
+        return await make_net_rbmsg(
+            self.skip__code, self.msg, sid=self.sid, lsid=self.lsid)
 
     @classmethod
     async def _parse_rbmsg_code(cls, rbmsg: dict) -> Res[str]:
         if "codeid" not in rbmsg:
             return Err(ValErr(f"msg {rbmsg} must have \"codeid\" field"))
         codeid = rbmsg["codeid"]
-        del rbmsg["codeid"]
         if not isinstance(codeid, int):
             return Err(ValErr(
                 f"invalid type of codeid {codeid}, expected int"))
 
         code_res = await Code.get_regd_code_by_id(codeid)
-        if isinstance(code_res, Err):
+        if type(code_res) is Err:
             return code_res
         code = code_res.okval
         if not Code.has_code(code):
@@ -131,36 +153,11 @@ class Bmsg(BaseModel):
         return Ok(code)
 
     @classmethod
-    def _get_keys_to_del_from_serialized(cls, body: dict) -> list[str]:
-        keys_to_del: list[str] = []
-        is_msid_found = False
-        for k, v in body.items():
-            if k == "sid":
-                is_msid_found = True
-                continue
-            # all internal or skipped keys are deleted from the final
-            # serialization
-            if (
-                    v is None
-                    or k.startswith(("internal__", "skip__"))):
-                keys_to_del.append(k)
-        if not is_msid_found:
-            raise ValueError(f"no sid field for rbmsg {body}")
-        return keys_to_del
-
-    @classmethod
-    async def _parse_rbmsg_msg(cls, rbmsg: dict) -> Res[Msg]:
+    async def _parse_rbmsg_msg(cls, rbmsg: dict, code: str) -> Res[Msg]:
         msg = rbmsg.get("msg", None)
 
-        code_res = await cls._parse_rbmsg_code(rbmsg)
-        if isinstance(code_res, Err):
-            return code_res
-        code = code_res.okval
-
-        rbmsg["skip__code"] = code
-
         custom_type_res = await Code.get_regd_type_by_code(code)
-        if isinstance(custom_type_res, Err):
+        if type(custom_type_res) is Err:
             return custom_type_res
         custom_type = custom_type_res.okval
 
@@ -185,23 +182,38 @@ class Bmsg(BaseModel):
         return resultify(final_deserialize_fn)
 
     @classmethod
-    async def deserialize_from_net(cls, rbmsg: dict) -> Res[Self]:
-        """Recovers model of this class using dictionary."""
+    async def deserialize_from_net(
+            cls, rbmsg: dict, consid: str | None = None) -> Res[Self]:
+        """
+        Recovers model of this class using dictionary.
+
+        The rbmsg is left untouched.
+
+        Args:
+            rbmsg: Msg received from the net.
+            consid: Sid of the con the msg is received from.
+        """
+        code = await cls._parse_rbmsg_code(rbmsg)
+        if type(code) is Err:
+            return code
+        code = code.okval
+
         # parse body separately according to it's regd type
-        msg = await cls._parse_rbmsg_msg(rbmsg)
-        if isinstance(msg, Err):
+        msg = await cls._parse_rbmsg_msg(rbmsg, code)
+        if type(msg) is Err:
             return msg
         msg = msg.okval
 
-        if "lsid" not in rbmsg:
-            rbmsg["lsid"] = None
-
-        rbmsg = rbmsg.copy()
-        # don't do redundant serialization of Any type
-        rbmsg["msg"] = None
-        bmsg = cls.model_validate(rbmsg.copy())
-        bmsg.msg = msg
-        return Ok(bmsg)
+        # only envelope fields are validated, unknown keys sent by the client
+        # are not copied along. The body is already parsed and "Any" field
+        # leaves it as is
+        return resultify(lambda: cls.model_validate({
+            "sid": rbmsg.get("sid", ""),
+            "lsid": rbmsg.get("lsid", None),
+            "skip__consid": consid,
+            "skip__code": code,
+            "msg": msg,
+        }))
 
 TBmsg = TypeVar("TBmsg", bound=Bmsg)
 # lowercase to not conflict with result.Ok
@@ -0,0 +1,227 @@
+"""
+Tcp transport built directly on asyncio.Protocol.
+
+Each msg is framed as 4-byte big-endian payload length followed by the JSON
+payload. Frames are parsed right in ``data_received`` and sent with
+synchronous ``transport.write``, so no stream reader/writer await hops are
+involved.
+
+The server is started by the app, e.g.:
+
+    await loop.create_server(
+        lambda: TcpProtocol(Bus.ie().con), host, port)
+
+The protocol works with any asyncio loop, so for extra loop throughput the
+app may install uvloop (``yon.server.install_uvloop()``) before the loop is
+created.
+"""
+import asyncio
+import struct
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Self
+
+from ryz.log import log
+
+from yon.server._transport import (
+    Con,
+    ConArgs,
+    PreparedRbmsg,
+    json_dumps_bytes,
+    json_loads,
+)
+
+_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE: int = 16 * 1024 * 1024
+"""
+Frames with bigger declared payload size are considered malformed and cause
+the con to be closed.
+"""
+LARGE_PAYLOAD_SIZE: int = 64 * 1024
+"""
+Payloads of this size or bigger are written without joining with the frame
+header.
+"""
+
+def pack_frame_into(buf: bytearray, payload: bytes) -> int:
+    """
+    Frames the payload at the start of the buffer, which must be big enough
+    to hold the frame.
+
+    Returns:
+        Size of the written frame.
+    """
+    size = len(payload)
+    end = _HEADER.size + size
+    _HEADER.pack_into(buf, 0, size)
+    buf[_HEADER.size:end] = payload
+    return end
+
+def unpack_frames(buf: bytearray) -> tuple[list[bytes], int]:
+    """
+    Parses all complete frames from the buffer.
+
+    Returns:
+        Payloads of the complete frames and amount of consumed bytes.
+
+    Raises:
+        ValueError: a frame declares size bigger than MAX_FRAME_SIZE.
+    """
+    payloads: list[bytes] = []
+    header_size = _HEADER.size
+    size = len(buf)
+    offset = 0
+    # slicing bytearray directly would copy the payload twice - first to
+    # a new bytearray, then to bytes. The view is released on exit, so the
+    # caller can resize the buffer afterwards
+    with memoryview(buf) as view:
+        while size - offset >= header_size:
+            (payload_size,) = _HEADER.unpack_from(view, offset)
+            if payload_size > MAX_FRAME_SIZE:
+                raise ValueError(
+                    f"frame size {payload_size} exceeds max {MAX_FRAME_SIZE}")
+            end = offset + header_size + payload_size
+            if end > size:
+                break
+            payloads.append(bytes(view[offset + header_size:end]))
+            offset = end
+    return payloads, offset
+
+class Tcp(Con[asyncio.Transport]):
+    def __init__(self, args: ConArgs[asyncio.Transport]) -> None:
+        super().__init__(args)
+        self._inp: deque[dict] = deque()
+        self._inp_evt = asyncio.Event()
+        self._is_eof = False
+        self._writable_evt = asyncio.Event()
+        self._writable_evt.set()
+        # reused to frame small payloads, while the transport doesn't hold it
+        self._scratch: bytearray | None = None
+
+    def __aiter__(self) -> Self:
+        return self
+
+    async def __anext__(self) -> dict:
+        while not self._inp:
+            if self._is_eof:
+                raise StopAsyncIteration
+            self._inp_evt.clear()
+            await self._inp_evt.wait()
+        return self._inp.popleft()
+
+    async def recv(self) -> dict:
+        try:
+            return await self.__anext__()
+        except StopAsyncIteration as err:
+            raise ConnectionError(f"con {self} is closed") from err
+
+    def recv_nowait(self) -> dict | None:
+        if self._inp:
+            return self._inp.popleft()
+        return None
+
+    async def send(self, data: dict):
+        await self._write(json_dumps_bytes(data))
+
+    async def send_prepared(self, prepared: PreparedRbmsg):
+        await self._write(prepared.encoded_bytes)
+
+    async def close(self):
+        self._is_closed = True
+        self._core.close()
+
+    async def _write(self, payload: bytes):
+        if self._is_closed:
+            raise ConnectionError(f"con {self} is closed")
+        # respect transport's flow control
+        if not self._writable_evt.is_set():
+            await self._writable_evt.wait()
+        if len(payload) >= LARGE_PAYLOAD_SIZE:
+            # don't copy big payload just to prepend the header - on python
+            # 3.12+ writelines passes the buffers to sendmsg as they are
+            self._core.writelines((_HEADER.pack(len(payload)), payload))
+        else:
+            self._write_small(payload)
+
+    def _write_small(self, payload: bytes):
+        frame_size = _HEADER.size + len(payload)
+        scratch = self._scratch
+        if scratch is None or len(scratch) < frame_size:
+            scratch = bytearray(frame_size)
+        pack_frame_into(scratch, payload)
+        self._core.write(memoryview(scratch)[:frame_size])
+        # if the data wasn't sent at once, the transport may keep referencing
+        # the scratch until it's flushed, so the next write takes a new one
+        is_flushed = self._core.get_write_buffer_size() == 0
+        self._scratch = scratch if is_flushed else None
+
+    def _feed(self, rbmsg: dict):
+        self._inp.append(rbmsg)
+        self._inp_evt.set()
+
+    def _feed_eof(self):
+        self._is_eof = True
+        self._is_closed = True
+        self._inp_evt.set()
+        # unblock writers, they will see closed state
+        self._writable_evt.set()
+
+class TcpProtocol(asyncio.Protocol):
+    """
+    Creates Tcp con for each new conection and passes it to ``on_con``,
+    which is typically ``Bus.con``.
+    """
+    def __init__(self, on_con: Callable[[Tcp], Awaitable[None]]) -> None:
+        self._on_con = on_con
+        self._buf = bytearray()
+        self._con: Tcp | None = None
+        self._con_task: asyncio.Task | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        assert isinstance(transport, asyncio.Transport)
+        self._con = Tcp(ConArgs(core=transport))
+        self._con_task = asyncio.get_running_loop().create_task(
+            self._on_con(self._con))
+
+    def connection_lost(self, exc: Exception | None):
+        if self._con is not None:
+            self._con._feed_eof()  # noqa: SLF001
+
+    def pause_writing(self):
+        if self._con is not None:
+            self._con._writable_evt.clear()  # noqa: SLF001
+
+    def resume_writing(self):
+        if self._con is not None:
+            self._con._writable_evt.set()  # noqa: SLF001
+
+    def data_received(self, data: bytes):
+        con = self._con
+        assert con is not None
+        buf = self._buf
+        buf.extend(data)
+        try:
+            payloads, consumed = unpack_frames(buf)
+        except ValueError as err:
+            self._abort(str(err))
+            return
+        # consumed frames are removed at once, not one by one
+        del buf[:consumed]
+        for payload in payloads:
+            try:
+                rbmsg = json_loads(payload)
+            except ValueError as err:
+                self._abort(f"invalid json payload: {err}")
+                return
+            if not isinstance(rbmsg, dict):
+                self._abort(f"rbmsg {rbmsg} must be a dict")
+                return
+            con._feed(rbmsg)  # noqa: SLF001
+
+    def _abort(self, reason: str):
+        con = self._con
+        log.err(f"malformed data on tcp con {con}: {reason} => close")
+        self._buf.clear()
+        if con is not None:
+            con._feed_eof()  # noqa: SLF001
+            con._core.close()  # noqa: SLF001
@@ -8,31 +8,111 @@ For a server general guideline would be to setup external conection manager,
 and pass new established conections to ServerBus.con method, where
 conection processing further relies on ServerBus.
 """
-from asyncio import Queue, Task
-from typing import Generic, Protocol, Self, TypeVar, runtime_checkable
-
-from pydantic import BaseModel
-from ryz.uuid import uuid4
+import asyncio
+import os
+import sys
+import threading
+from asyncio import QueueFull, Task
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import (
+    ClassVar,
+    Generic,
+    Iterable,
+    Self,
+    TypeVar,
+)
+
+import orjson
+from pydantic import BaseModel, model_validator
 
 TConCore = TypeVar("TConCore")
+T = TypeVar("T")
 
 # we pass consid to OnSend and OnRecv functions instead of Con to
 # not allow these methods to operate on conection, but instead request
 # required information about it via the bus
-@runtime_checkable
-class OnSendFn(Protocol):
-    async def __call__(self, consid: str, rbmsg: dict): ...
+#
+# plain callable aliases are used instead of runtime checkable protocols, so
+# no structural isinstance check is made on transport validation
+OnSendFn = Callable[[str, dict], Awaitable[None]]
+OnRecvFn = Callable[[str, dict], Awaitable[None]]
 
-# generic Protocol[TConMsg] is not used due to variance issues
-@runtime_checkable
-class OnRecvFn(Protocol):
-    async def __call__(self, consid: str, rbmsg: dict): ...
+class _IdPool:
+    """
+    Source of random con and msg ids.
 
-class ConArgs(BaseModel, Generic[TConCore]):
+    Random bytes are read by chunks for many ids at once, to not make
+    urandom syscall per each new id.
+    """
+    IDSIZE: ClassVar[int] = 16
+    POOLSIZE: ClassVar[int] = 1024
+
+    _buf: ClassVar[bytes] = b""
+    _idx: ClassVar[int] = 0
+    _lock: ClassVar[threading.Lock] = threading.Lock()
+
+    @classmethod
+    def next(cls) -> str:
+        with cls._lock:
+            if cls._idx >= len(cls._buf):
+                cls._buf = os.urandom(cls.IDSIZE * cls.POOLSIZE)
+                cls._idx = 0
+            i = cls._idx
+            cls._idx = i + cls.IDSIZE
+            return cls._buf[i:i + cls.IDSIZE].hex()
+
+    @classmethod
+    def reset(cls):
+        cls._buf = b""
+        cls._idx = 0
+
+# forked process must not hand out the same ids as it's parent
+os.register_at_fork(after_in_child=_IdPool.reset)
+
+# internal carriers are plain slotted dataclasses - they're constructed per
+# con/transport from trusted code and don't need validation
+@dataclass(slots=True)
+class ConArgs(Generic[TConCore]):
     core: TConCore
+    tokens: frozenset[str] | None = None
 
-    class Config:
-        arbitrary_types_allowed = True
+def json_dumps_bytes(data: dict) -> bytes:
+    # json module converts non-str keys to str, so we keep this behaviour
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+def json_dumps(data: dict) -> str:
+    return json_dumps_bytes(data).decode()
+
+def json_loads(data: str | bytes) -> dict:
+    return orjson.loads(data)
+
+class PreparedRbmsg:
+    """
+    Rbmsg shared between many recipients.
+
+    Encoded forms are computed once on the first request, so the same msg
+    sent to many cons is serialized only once.
+    """
+    __slots__ = ("rbmsg", "_encoded", "_encoded_bytes")
+
+    def __init__(self, rbmsg: dict) -> None:
+        self.rbmsg = rbmsg
+        self._encoded: str | None = None
+        self._encoded_bytes: bytes | None = None
+
+    @property
+    def encoded(self) -> str:
+        if self._encoded is None:
+            self._encoded = self.encoded_bytes.decode()
+        return self._encoded
+
+    @property
+    def encoded_bytes(self) -> bytes:
+        if self._encoded_bytes is None:
+            self._encoded_bytes = json_dumps_bytes(self.rbmsg)
+        return self._encoded_bytes
 
 class Con(Generic[TConCore]):
     """
@@ -45,11 +125,13 @@ class Con(Generic[TConCore]):
     can be conveniently done only through parsed dict object.
     """
     def __init__(self, args: ConArgs[TConCore]) -> None:
-        self._sid = uuid4()
+        self._sid = _IdPool.next()
         self._core = args.core
         self._is_closed = False
+        self._out_queue: BatchQueue[tuple[Con, PreparedRbmsg]] | None = None
 
-        self._tokens: list[str] = []
+        self._tokens: frozenset[str] = \
+            frozenset(args.tokens) if args.tokens else frozenset()
 
     def __aiter__(self) -> Self:
         raise NotImplementedError
@@ -61,15 +143,33 @@ class Con(Generic[TConCore]):
     def sid(self) -> str:
         return self._sid
 
-    def get_tokens(self) -> list[str]:
+    def get_tokens(self) -> frozenset[str]:
         """
         May also return empty tokens. This would mean that the con is not yet
         registered.
+
+        Tokens are immutable, so they are returned without copying.
         """
-        return self._tokens.copy()
+        return self._tokens
 
-    def set_tokens(self, tokens: list[str]):
-        self._tokens = tokens.copy()
+    def set_tokens(self, tokens: Iterable[str]):
+        self._tokens = frozenset(tokens)
+
+    def get_out_queue(self) -> "BatchQueue[tuple[Con, PreparedRbmsg]] | None":
+        """
+        Returns out queue of the con's transport, or None if the con is not
+        yet accepted by the bus.
+        """
+        return self._out_queue
+
+    def set_out_queue(self, queue: "BatchQueue[tuple[Con, PreparedRbmsg]]"):
+        """
+        Attaches out queue of the con's transport.
+
+        Called by the bus once the con is accepted, so msgs to the con don't
+        need to look up it's transport.
+        """
+        self._out_queue = queue
 
     def is_closed(self) -> bool:
         return self._is_closed
@@ -77,9 +177,27 @@ class Con(Generic[TConCore]):
     async def recv(self) -> dict:
         raise NotImplementedError
 
+    def recv_nowait(self) -> dict | None:
+        """
+        Returns already received msg without waiting, or None if there is no
+        such.
+
+        Cons which can't tell whether a msg is ready always return None.
+        """
+        return None
+
     async def send(self, data: dict):
         raise NotImplementedError
 
+    async def send_prepared(self, prepared: PreparedRbmsg):
+        """
+        Sends msg which may be shared with other cons.
+
+        Implementations able to send encoded data directly should override
+        this to reuse ``prepared.encoded``.
+        """
+        await self.send(prepared.rbmsg)
+
     async def close(self):
         raise NotImplementedError
 
@@ -100,6 +218,49 @@ class Transport(BaseModel):
     """
     If less or equal than zero, no limitation is applied.
     """
+    max_out_batch_size: int = 256
+    """
+    Max amount of msgs taken from the out queue per processor wakeup.
+
+    If less or equal than zero, no limitation is applied.
+    """
+    max_inp_batch_size: int = 256
+    """
+    Max amount of already received msgs of a con put to the inp queue at
+    once.
+
+    If less or equal than zero, no limitation is applied.
+    """
+    max_recv_concurrency: int = 256
+    """
+    Max amount of received msgs being processed at the same time, including
+    spawned rpc calls.
+
+    Once reached, the inp queue is not read further, so incoming msgs pile
+    up there until max_inp_queue_size is hit.
+
+    If less or equal than zero, no limitation is applied.
+    """
+
+    inp_workers: int = 1
+    """
+    Amount of inp queue processors.
+
+    With more than one processor, msgs are processed concurrently whenever
+    a processor awaits (e.g. on_recv hook or subfns), but msgs of the same
+    con are no longer guaranteed to be processed in the receive order.
+
+    Values less than one are treated as one.
+    """
+    out_workers: int = 1
+    """
+    Amount of out queue processors.
+
+    With more than one processor, msgs of the same con are no longer
+    guaranteed to be sent in the pub order.
+
+    Values less than one are treated as one.
+    """
 
     # TODO: add "max_msgs_per_minute" to limit conection's activity
 
@@ -126,23 +287,109 @@ class Transport(BaseModel):
     class Config:
         arbitrary_types_allowed = True
 
+    @model_validator(mode="after")
+    def _intern_strs(self) -> Self:
+        # transports usually share the same few values, so they're kept as
+        # single objects and compared by identity fast path
+        self.protocol = sys.intern(self.protocol)
+        self.host = sys.intern(self.host)
+        self.route = sys.intern(self.route)
+        return self
+
+    # not cached, since the fields can be changed after the construction,
+    # e.g. by model_copy(update=...) which would copy the cache along
     @property
     def url(self) -> str:
-        return \
-            self.protocol \
-            + "://" \
-            + self.host \
-            + ":" \
-            + str(self.port) \
-            + "/" \
-            + self.route
-
-class ActiveTransport(BaseModel):
-    transport: Transport
-    inp_queue: Queue[tuple[Con, dict]]
-    out_queue: Queue[tuple[Con, dict]]
-    inp_queue_processor: Task
-    out_queue_processor: Task
+        return f"{self.protocol}://{self.host}:{self.port}/{self.route}"
 
-    class Config:
-        arbitrary_types_allowed = True
+class BatchQueue(Generic[T]):
+    """
+    Queue which consumer takes items from by batches.
+
+    Unlike asyncio.Queue, no future is created per item: producers only
+    append to the underlying deque and set the event, so the consumer is
+    woken up once per batch.
+    """
+    def __init__(self, maxsize: int = 0) -> None:
+        self._items: deque[T] = deque()
+        self._maxsize = maxsize
+        self._nonempty_evt = asyncio.Event()
+        self._drained_evt = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def is_full(self) -> bool:
+        return 0 < self._maxsize <= len(self._items)
+
+    async def put(self, item: T):
+        while self.is_full():
+            self._drained_evt.clear()
+            await self._drained_evt.wait()
+        self._items.append(item)
+        self._nonempty_evt.set()
+
+    def put_nowait(self, item: T):
+        """
+        Raises:
+            QueueFull: if the queue has reached it's maxsize.
+        """
+        if self.is_full():
+            raise QueueFull
+        self._items.append(item)
+        self._nonempty_evt.set()
+
+    async def put_many(self, items: list[T]):
+        """
+        Puts the items, waking up the getter only once if all of them fit
+        into the queue.
+        """
+        if self._maxsize > 0 and len(self._items) + len(items) > self._maxsize:
+            # wait for the room item by item
+            for item in items:
+                await self.put(item)
+            return
+        self._items.extend(items)
+        self._nonempty_evt.set()
+
+    def put_many_nowait(self, items: list[T]):
+        """
+        Puts all the items at once, waking up the getter only once.
+
+        Raises:
+            QueueFull: if the items don't fit into the queue, in which case
+                none of them is put.
+        """
+        if self._maxsize > 0 and len(self._items) + len(items) > self._maxsize:
+            raise QueueFull
+        self._items.extend(items)
+        self._nonempty_evt.set()
+
+    async def get_batch(self, maxsize: int = 0) -> deque[T]:
+        """
+        Waits for at least one item and takes up to ``maxsize`` items.
+
+        If maxsize is less or equal than zero, all available items are taken.
+        """
+        while not self._items:
+            self._nonempty_evt.clear()
+            await self._nonempty_evt.wait()
+        items = self._items
+        if maxsize <= 0 or len(items) <= maxsize:
+            # the whole storage is handed to the consumer, and producers
+            # continue with a fresh one, so no items are copied
+            batch = items
+            self._items = deque()
+        else:
+            batch = deque(items.popleft() for _ in range(maxsize))
+        self._drained_evt.set()
+        return batch
+
+@dataclass(slots=True)
+class ActiveTransport:
+    transport: Transport
+    inp_queue: BatchQueue[tuple[Con, dict]]
+    out_queue: BatchQueue[tuple[Con, PreparedRbmsg]]
+    recv_sem: asyncio.Semaphore | None
+    inp_queue_processors: list[Task]
+    out_queue_processors: list[Task]
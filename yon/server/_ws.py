@@ -1,9 +1,21 @@
 from typing import Self
 
-from aiohttp import WSMsgType
+from aiohttp import WSMessage, WSMsgType
 from aiohttp.web import WebSocketResponse as AiohttpWebsocket
 
-from yon.server._transport import Con, ConArgs
+from yon.server._transport import (
+    Con,
+    ConArgs,
+    PreparedRbmsg,
+    json_dumps,
+    json_dumps_bytes,
+    json_loads,
+)
+
+# aiohttp>=3.11 can send already encoded text frames. Orjson output is valid
+# utf-8, so it's passed as is instead of decoding it to str for send_str,
+# which would encode it back
+_HAS_SEND_FRAME = hasattr(AiohttpWebsocket, "send_frame")
 
 
 class Ws(Con[AiohttpWebsocket]):
@@ -18,13 +30,31 @@ class Ws(Con[AiohttpWebsocket]):
         if conmsg.type in (
                 WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED):
             raise StopAsyncIteration
-        return conmsg.json()
+        return self._parse(conmsg)
 
     async def recv(self) -> dict:
-        return await self._core.receive_json()
+        return self._parse(await self._core.receive())
 
     async def send(self, data: dict):
-        return await self._core.send_json(data)
+        if _HAS_SEND_FRAME:
+            return await self._core.send_frame(
+                json_dumps_bytes(data), WSMsgType.TEXT)
+        return await self._core.send_json(data, dumps=json_dumps)
+
+    async def send_prepared(self, prepared: PreparedRbmsg):
+        if _HAS_SEND_FRAME:
+            return await self._core.send_frame(
+                prepared.encoded_bytes, WSMsgType.TEXT)
+        return await self._core.send_str(prepared.encoded)
 
     async def close(self):
         return await self._core.close()
+
+    def _parse(self, conmsg: WSMessage) -> dict:
+        # both text and binary frames are passed to orjson as they are, binary
+        # ones aren't decoded to str first
+        if conmsg.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+            raise TypeError(
+                f"received msg {conmsg.type}:{conmsg.data!r} is not"
+                " text or binary")
+        return json_loads(conmsg.data)